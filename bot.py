@@ -3,19 +3,36 @@ import asyncio
 import sys
 import logging
 import random
+import time
 from datetime import datetime
+from typing import Optional, Tuple
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
 from aiogram.filters import CommandStart, Command
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-import aiosqlite
-
-from config import BOT_TOKEN, ADMIN_CHANNEL_ID, ADMIN_ID, MIN_REFERRALS, MIN_STARS_WITHDRAW
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+
+from config import (
+    BOT_TOKEN, ADMIN_CHANNEL_ID, ADMIN_ID, MIN_REFERRALS, MIN_STARS_WITHDRAW, MAX_PENDING_WITHDRAWALS,
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PER_CHAT_INTERVAL, BROADCAST_MAX_RETRIES,
+    BROADCAST_CHUNK_SIZE, TELEGRAM_API_URL, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY, BOT_INFO_REFRESH, PRE_CHECKOUT_SLOW_MS,
+    DICE_REVEAL_DELAY, DELAYED_SEND_CONCURRENCY
+)
 from database import *
 from keyboards import *
+from leaderboard import leaderboard
+from broadcast import Broadcaster, BroadcastJobs
+from webhook import run_webhook
+from fsm_storage import create_storage, clear_state
+from locks import KeyedLockManager, UserLockMiddleware
+from runtime import BotRuntime, LatencyStats
+from scheduler import DelayedQueue
+import texts
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,16 +50,35 @@ class AdminStates(StatesGroup):
     waiting_for_bet_amount = State()
     waiting_for_nft_link = State()
 
-# Множество для отслеживания обрабатываемых dice (анти-спам)
-processing_dice = set()
-
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-storage = MemoryStorage()
+# TELEGRAM_API_URL позволяет направить бота на локальный (тестовый) Bot API сервер
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML, session=session)
+broadcaster = Broadcaster(
+    bot,
+    rate=BROADCAST_RATE,
+    concurrency=BROADCAST_CONCURRENCY,
+    per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+    max_retries=BROADCAST_MAX_RETRIES,
+)
+broadcast_jobs = BroadcastJobs(broadcaster, chunk_size=BROADCAST_CHUNK_SIZE, reply_markup=main_menu_kb())
+# FSM и анти-двойной клик — в общем хранилище (см. FSM_STORAGE), чтобы работать в несколько процессов
+storage, shared_locks = create_storage()
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
-
-processing_requests = set()
+# Профиль бота (get_me) кэшируется здесь; хендлеры получают его аргументом runtime
+runtime = BotRuntime(bot, BOT_INFO_REFRESH)
+dp["runtime"] = runtime
+# Время ответа на pre_checkout_query: после 10 секунд Telegram отменяет оплату
+pre_checkout_latency = LatencyStats(PRE_CHECKOUT_SLOW_MS / 1000)
+# Отложенные сообщения (результат броска после анимации) вместо sleep в хендлерах
+delayed = DelayedQueue(DELAYED_SEND_CONCURRENCY)
+
+# Хендлеры с флагом user_lock выполняются по очереди для одного пользователя
+user_locks = KeyedLockManager()
+user_lock_middleware = UserLockMiddleware(user_locks, shared=shared_locks)
+router.message.middleware(user_lock_middleware)
+router.callback_query.middleware(user_lock_middleware)
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, command: CommandStart):
@@ -59,6 +95,9 @@ async def cmd_start(message: Message, command: CommandStart):
     is_new = await add_user(user_id, username, full_name, referrer_id)
     
     if not is_new:
+        # Вернулся после блокировки — снова включаем в рассылки
+        if await reactivate_user(user_id):
+            logger.info(f"Пользователь {user_id} снова доступен для рассылок")
         await message.answer(
             "👋 Вы уже зарегистрированы в системе!",
             reply_markup=main_menu_kb()
@@ -66,32 +105,18 @@ async def cmd_start(message: Message, command: CommandStart):
         return
     
     if referrer_id:
-        referrer_data_before = await get_user(referrer_id)
-        if referrer_data_before:
-            await increment_referrals(referrer_id)
-            await add_stars(referrer_id, 1)
-            referrer_data_after = await get_user(referrer_id)
-            
+        new_balance = await credit_referral(referrer_id, 1)
+        if new_balance is not None:
             try:
                 await bot.send_message(
                     referrer_id,
-                    f"⭐ <b>Заработана 1 Stars!</b>\n\n"
-                    f"<blockquote>Пользователь @{username or 'скрыт'} присоединился по вашей ссылке!</blockquote>\n\n"
-                    f"💎 Ваш баланс: <b>{referrer_data_after[5]} ⭐ Stars</b>",
+                    texts.REFERRAL_CREDITED.render(username=username or "скрыт", balance=new_balance),
                     reply_markup=main_menu_kb()
                 )
             except Exception as e:
                 logger.error(f"Ошибка отправки уведомления рефереру {referrer_id}: {e}")
     
-    welcome_text = (
-        f"<b>🌟 Добро пожаловать в StarsZone!</b>\n\n"
-        f"Привет, <b>{full_name}</b>! Рады видеть тебя здесь.\n\n"
-        f"<blockquote>💰 Принцип максимально прост:\n"
-        f"• Получите свою реферальную ссылку\n"
-        f"• Поделитесь ею с другом\n"
-        f"• Мгновенно получите 1 ⭐ за каждого друга!</blockquote>\n\n"
-        f"<b>Начинайте зарабатывать прямо сейчас!</b>"
-    )
+    welcome_text = texts.WELCOME.render(full_name=full_name)
     
     await message.answer(welcome_text, reply_markup=main_menu_kb())
 
@@ -103,20 +128,14 @@ async def show_profile(callback: CallbackQuery):
         await callback.answer("❌ Пользователь не найден!", show_alert=True)
         return
     
-    profile_text = (
-        f"👤 <b>Мой профиль</b>\n\n"
-        f"<blockquote>"
-        f"🆔 ID: <code>{user_data[0]}</code>\n"
-        f"👤 Username: @{user_data[1] or 'скрыт'}\n"
-        f"📛 Имя: <b>{user_data[2] or 'Без имени'}</b>\n"
-        f"📅 Дата: {user_data[6][:10] if user_data[6] else 'Неизвестно'}"
-        f"</blockquote>\n\n"
-        f"<blockquote>"
-        f"📊 Моя статистика:\n"
-        f"├ Приглашено: <b>{user_data[4]} человек</b>\n"
-        f"└ Заработано: <b>{user_data[5]} ⭐ Stars</b>"
-        f"</blockquote>\n\n"
-        f"<i>Каждый новый друг — новая звезда!</i>"
+    profile_text = texts.PROFILE.render(
+        user_id=user_data[0],
+        username=user_data[1] or "скрыт",
+        full_name=texts.user_name(user_data[2]),
+        joined=texts.short_date(user_data[6]),
+        referrals=user_data[4],
+        stars=user_data[5],
+        rank=leaderboard.rank(user_data[4]),
     )
     
     await callback.message.edit_text(profile_text, reply_markup=back_to_menu_kb())
@@ -124,57 +143,21 @@ async def show_profile(callback: CallbackQuery):
 
 @router.callback_query(F.data == "top")
 async def show_top(callback: CallbackQuery):
-    top_users = await get_top_referrers(10)
+    top_text = leaderboard.text
     
-    if not top_users:
+    if not top_text:
         await callback.answer("🏆 Топ пока пуст!", show_alert=True)
         return
     
-    top_text = (
-        f"🏆 <b>ТОП-10 РЕФЕРЕРОВ</b>\n\n"
-        f"<blockquote>"
-    )
-    
-    for idx, (user_id, username, refs, stars) in enumerate(top_users, 1):
-        medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(idx, "💠")
-        name = f"@{username}" if username else f"ID:{user_id}"
-        top_text += f"{medal} <b>{name}</b> │ {refs} чел. │ {stars}⭐\n"
-    
-    top_text += (
-        f"</blockquote>\n\n"
-        f"<blockquote>🎯 Ваша цель: попасть в топ и заработать максимум звезд!</blockquote>"
-    )
-    
     await callback.message.edit_text(top_text, reply_markup=back_to_menu_kb())
     await callback.answer()
 
 @router.callback_query(F.data == "how_to_earn")
-async def show_how_to_earn(callback: CallbackQuery):
-    bot_info = await bot.get_me()
-    ref_link = f"https://t.me/{bot_info.username}?start={callback.from_user.id}"
-    
-    earn_text = (
-        f"💰 <b>КАК ЗАРАБОТАТЬ ЗВЕЗДЫ</b>\n\n"
-        f"<blockquote>"
-        f"<b>ШАГ 1:</b> Получите свою ссылку\n"
-        f"└ Нажмите кнопку 'Поделится'\n\n"
-        f"<b>ШАГ 2:</b> Поделитесь с другом\n"
-        f"└ Отправьте ссылку в ЛС или чат\n\n"
-        f"<b>ШАГ 3:</b> Получите звезду мгновенно!\n"
-        f"└ Как только друг присоединится — вы получаете 1 ⭐"
-        f"</blockquote>\n\n"
-        f"<blockquote>"
-        f"💡 <b>Где размещать ссылку?</b>\n"
-        f"• В Telegram чатах (тематических)\n"
-        f"• В соцсетях (ВК, Instagram, TikTok)\n"
-        f"• На форумах и в комментариях\n"
-        f"• Расскажите друзьям лично!"
-        f"</blockquote>\n\n"
-        f"<b>⚡ Ваша ссылка готова — начинайте зарабатывать!</b>"
-    )
+async def show_how_to_earn(callback: CallbackQuery, runtime: BotRuntime):
+    ref_link = await runtime.ref_link(callback.from_user.id)
     
     await callback.message.edit_text(
-        earn_text, 
+        texts.HOW_TO_EARN, 
         reply_markup=share_link_kb(ref_link)
     )
     await callback.answer()
@@ -203,102 +186,79 @@ async def show_withdrawal_options(callback: CallbackQuery):
         )
         return
     
-    withdraw_text = (
-        f"💸 <b>Вывод Stars</b>\n\n"
-        f"<blockquote>"
-        f"📊 Ваш баланс: <b>{user_data[5]} ⭐</b>\n"
-        f"👥 Рефералов: <b>{user_data[4]} человек</b>\n"
-        f"</blockquote>\n\n"
-        f"<blockquote>Выберите сумму для вывода:</blockquote>"
-    )
-    
     await callback.message.edit_text(
-        withdraw_text, 
+        texts.WITHDRAW_MENU.render(stars=user_data[5], referrals=user_data[4]), 
         reply_markup=withdrawal_amounts_kb()
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("withdraw_"))
+@router.callback_query(F.data.startswith("withdraw_"), flags={"user_lock": "withdraw"})
 async def process_withdrawal(callback: CallbackQuery):
     user_id = callback.from_user.id
     
-    if user_id in processing_requests:
-        await callback.answer("⏳ Запрос уже обрабатывается!", show_alert=True)
+    amount = int(callback.data.split("_")[1])
+    
+    # Проверки, списание и заявка — одна транзакция в БД
+    result, info = await create_withdrawal_request(
+        user_id, amount, min_referrals=MIN_REFERRALS, max_pending=MAX_PENDING_WITHDRAWALS
+    )
+    
+    if result == WITHDRAW_NO_USER:
+        await callback.answer("❌ Пользователь не найден!", show_alert=True)
+        return
+    
+    if result == WITHDRAW_FEW_REFERRALS:
+        await callback.answer(f"❌ Минимум {MIN_REFERRALS} рефералов!", show_alert=True)
+        return
+    
+    if result == WITHDRAW_LOW_BALANCE:
+        await callback.answer(
+            f"❌ Недостаточно Stars!\nНужно: {amount} | У вас: {info['balance']}", 
+            show_alert=True
+        )
+        return
+    
+    if result == WITHDRAW_TOO_MANY_PENDING:
+        await callback.answer(
+            f"❌ У вас уже {info['pending']} заявки в обработке. Дождитесь решения.", show_alert=True
+        )
+        return
+    
+    if result != WITHDRAW_OK:
+        await callback.answer("❌ Ошибка создания заявки!", show_alert=True)
         return
     
+    request_id = info["request_id"]
     try:
-        processing_requests.add(user_id)
-        amount = int(callback.data.split("_")[1])
-        
-        user_data = await get_user(user_id)
-        if not user_data:
-            await callback.answer("❌ Пользователь не найден!", show_alert=True)
-            return
-        
-        if user_data[4] < MIN_REFERRALS:
-            await callback.answer(f"❌ Минимум {MIN_REFERRALS} рефералов!", show_alert=True)
-            return
-        
-        if user_data[5] < amount:
-            await callback.answer(
-                f"❌ Недостаточно Stars!\nНужно: {amount} | У вас: {user_data[5]}", 
-                show_alert=True
-            )
-            return
-        
-        pending_count = await get_pending_withdrawals_count(user_id)
-        if pending_count >= 3:
-            await callback.answer("❌ У вас уже 3 заявки в обработке. Дождитесь решения.", show_alert=True)
-            return
-        
-        request_id = await create_withdrawal_request(user_id, amount)
-        
-        if not request_id:
-            await callback.answer("❌ Ошибка создания заявки!", show_alert=True)
-            return
-        
-        try:
-            bot_info = await bot.get_me()
-            user_link = f"tg://user?id={user_id}"
-            
-            admin_message = (
-                f"🆔 <b>Заявка на вывод #{request_id}</b>\n\n"
-                f"<blockquote>"
-                f"👤 Пользователь: <a href='{user_link}'>{user_data[2] or 'Без имени'}</a>\n"
-                f"🆔 ID: <code>{user_id}</code>\n"
-                f"💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
-                f"📊 Баланс: {user_data[5]} | Рефералов: {user_data[4]}"
-                f"</blockquote>\n\n"
-            )
-            
-            await bot.send_message(
-                ADMIN_CHANNEL_ID, 
-                admin_message, 
-                reply_markup=admin_withdrawal_kb(request_id)
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки в админ-канал: {e}")
-            await add_stars(user_id, amount)
-            await callback.answer("❌ Ошибка отправки заявки админам!", show_alert=True)
-            return
-        
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M')
-        user_message = (
-            f"✅ <b>Заявка #{request_id} создана!</b>\n\n"
-            f"<blockquote>"
-            f"💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
-            f"⏳ Статус: В обработке\n"
-            f"📅 Дата: {current_time}"
-            f"</blockquote>\n\n"
-            f"<blockquote>⏰ Обычно выплата занимает 1-24 часа</blockquote>\n\n"
-            f"💎 Когда заявку одобрят — вы получите уведомление!"
+        admin_message = texts.WITHDRAWAL_ADMIN.render(
+            request_id=request_id,
+            user_id=user_id,
+            full_name=texts.user_name(info["full_name"]),
+            amount=amount,
+            balance=info["balance"],
+            referrals=info["referrals"],
         )
         
-        await callback.message.edit_text(user_message, reply_markup=back_to_menu_kb())
-        await callback.answer()
-        
-    finally:
-        processing_requests.discard(user_id)
+        await bot.send_message(
+            ADMIN_CHANNEL_ID, 
+            admin_message, 
+            reply_markup=admin_withdrawal_kb(request_id)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки в админ-канал: {e}")
+        # Заявку никто не увидит — отменяем ее и возвращаем звезды
+        await cancel_withdrawal_request(request_id)
+        await callback.answer("❌ Ошибка отправки заявки админам!", show_alert=True)
+        return
+    
+    user_message = texts.WITHDRAWAL_CREATED.render(
+        request_id=request_id,
+        amount=amount,
+        created=datetime.now().strftime('%Y-%m-%d %H:%M'),
+    )
+    
+    await callback.message.edit_text(user_message, reply_markup=back_to_menu_kb())
+    await callback.answer()
 
 @router.callback_query(F.data == "my_withdrawals")
 async def show_my_withdrawals(callback: CallbackQuery):
@@ -309,18 +269,16 @@ async def show_my_withdrawals(callback: CallbackQuery):
         await callback.answer("📭 У вас нет заявок", show_alert=True)
         return
     
-    withdrawal_text = f"📋 <b>Мои заявки на вывод</b>\n\n"
-    
-    for req in withdrawals:
-        status_emoji = {"pending": "⏳", "paid": "✅", "rejected": "❌"}
-        status_text = {"pending": "В обработке", "paid": "Выплачено", "rejected": "Отклонено"}
-        
-        withdrawal_text += (
-            f"<blockquote>"
-            f"🆔 #{req[0]} | 💰 {req[1]} ⭐\n"
-            f"📅 {req[3][:10] if req[3] else 'Неизвестно'} | {status_emoji.get(req[2], '❓')} <b>{status_text.get(req[2], 'Неизвестно')}</b>"
-            f"</blockquote>\n"
-        )
+    withdrawal_text = texts.MY_WITHDRAWALS_HEADER + texts.MY_WITHDRAWALS_ROW.render_many(
+        {
+            "request_id": req[0],
+            "amount": req[1],
+            "date": texts.short_date(req[3]),
+            "status_emoji": texts.WITHDRAWAL_STATUS_EMOJI.get(req[2], "❓"),
+            "status": texts.WITHDRAWAL_STATUS_TEXT.get(req[2], "Неизвестно"),
+        }
+        for req in withdrawals
+    )
     
     await callback.message.edit_text(withdrawal_text, reply_markup=my_withdrawals_kb())
     await callback.answer()
@@ -343,19 +301,11 @@ async def show_nft_giveaway(callback: CallbackQuery):
     giveaway_id, bet_amount, nft_link, is_active, created_by, winner_id, created_at, ended_at = giveaway
     stats = await get_giveaway_stats(giveaway_id)
     
-    text = (
-        f"🎰 <b>АКТИВНЫЙ РОЗЫГРЫШ NFT!</b>\n\n"
-        f"<blockquote>"
-        f"💎 <b>Приз:</b> <a href='{nft_link}'>NFT Подарок</a>\n"
-        f"💰 <b>Ставка:</b> {bet_amount} ⭐ Stars\n"
-        f"👥 <b>Уникальных игроков:</b> {stats['unique_users']}\n"
-        f"🎲 <b>Всего бросков:</b> {stats['total_attempts']}\n"
-        f"🎯 <b>Условия:</b> Выпадет <b>777 (64)</b> = выигрыш!"
-        f"</blockquote>\n\n"
-        f"<blockquote>🍀 <b>Испытайте свою удачу!</b>\n"
-        f"Нажмите кнопку ниже, оплатите {bet_amount} Stars и сыграйте.\n"
-        f"Если выпадет <b>777 (64)</b> (максимум) — NFT ваш!\n\n"
-        f"<i>Попыток неограничено!</i></blockquote>"
+    text = texts.GIVEAWAY_CARD.render(
+        nft_link=nft_link,
+        bet_amount=bet_amount,
+        unique_users=stats['unique_users'],
+        total_attempts=stats['total_attempts']
     )
     
     await callback.message.edit_text(
@@ -396,15 +346,50 @@ async def process_nft_payment(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка создания инвойса: {e}")
         await callback.answer("❌ Ошибка создания счета!", show_alert=True)
 
+async def check_nft_checkout(payload: str, user_id: int, currency: str, total_amount: int) -> Optional[str]:
+    """
+    Проверка оплаты по снимку активного розыгрыша в памяти (без запросов к
+    БД). None — можно платить, иначе текст ошибки для пользователя.
+    """
+    parts = payload.split("_")
+    if len(parts) != 3 or parts[0] != "nft" or not parts[1].isdigit() or not parts[2].isdigit():
+        return "Некорректный счет. Откройте розыгрыш заново."
+    giveaway_id, payer_id = int(parts[1]), int(parts[2])
+    if payer_id != user_id:
+        return "Этот счет выставлен другому пользователю."
+    
+    giveaway = await get_active_giveaway()
+    if not giveaway or giveaway[0] != giveaway_id:
+        return "Этот розыгрыш уже завершен."
+    if currency != "XTR" or total_amount != giveaway[1]:
+        return "Ставка изменилась. Откройте розыгрыш заново."
+    return None
+
 @router.pre_checkout_query()
 async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
-    """Обработка предварительной проверки оплаты"""
-    await pre_checkout_query.answer(ok=True)
+    """Предварительная проверка оплаты: розыгрыш еще активен и сумма совпадает"""
+    started = time.perf_counter()
+    error = await check_nft_checkout(
+        pre_checkout_query.invoice_payload,
+        pre_checkout_query.from_user.id,
+        pre_checkout_query.currency,
+        pre_checkout_query.total_amount,
+    )
+    try:
+        if error is None:
+            await pre_checkout_query.answer(ok=True)
+        else:
+            await pre_checkout_query.answer(ok=False, error_message=error)
+    finally:
+        elapsed = time.perf_counter() - started
+        if pre_checkout_latency.record(elapsed):
+            logger.warning(f"Медленный pre_checkout {pre_checkout_query.id}: {elapsed * 1000:.0f} мс")
 
 @router.message(F.successful_payment)
 async def successful_payment_handler(message: Message, state: FSMContext):
     """Обработка успешной оплаты - переход к игре"""
-    payload = message.successful_payment.invoice_payload
+    payment = message.successful_payment
+    payload = payment.invoice_payload
     
     if payload.startswith("nft_"):
         _, giveaway_id, user_id = payload.split("_")
@@ -412,16 +397,33 @@ async def successful_payment_handler(message: Message, state: FSMContext):
         user_id = int(user_id)
         
         giveaway = await get_active_giveaway()
-        if not giveaway or giveaway[0] != giveaway_id:
-            await message.answer("❌ Этот розыгрыш уже завершен!")
-            return
+        is_active = bool(giveaway) and giveaway[0] == giveaway_id
         
-        # Добавляем попытку в БД
-        attempt_id = await add_attempt(giveaway_id, user_id)
-        if not attempt_id:
+        # Платеж и попытка пишутся одной транзакцией; повторный апдейт с тем же charge_id — no-op
+        try:
+            attempt_id, created = await record_payment(
+                payment.telegram_payment_charge_id,
+                payment.provider_payment_charge_id,
+                message.from_user.id,
+                payment.total_amount,
+                payment.currency,
+                payload,
+                giveaway_id=giveaway_id,
+                create_attempt=is_active,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка записи платежа {payment.telegram_payment_charge_id}: {e}")
             await message.answer("❌ Ошибка создания попытки!")
             return
         
+        if not created:
+            logger.info(f"Платеж {payment.telegram_payment_charge_id} уже учтен, повтор пропущен")
+            return
+        
+        if not is_active:
+            await message.answer("❌ Этот розыгрыш уже завершен!")
+            return
+        
         attempts_count = await get_user_attempts_count(giveaway_id, user_id)
         
         # Сохраняем данные в FSM
@@ -434,113 +436,89 @@ async def successful_payment_handler(message: Message, state: FSMContext):
         )
         
         await message.answer(
-            f"✅ <b>Оплата прошла успешно!</b>\n\n"
-            f"<blockquote>"
-            f"🎰 Попытка #{attempts_count}\n"
-            f"💎 Приз: <a href='{giveaway[2]}'>NFT Подарок</a>\n"
-            f"🎯 Цель: Выпадение 777 (64)"
-            f"</blockquote>\n\n"
-            f"<b>👉 Отправьте анимированный эмодзи</b> 🎰 <b>(Слот-машина)</b>\n\n",
+            texts.PAYMENT_OK.render(attempt=attempts_count, nft_link=giveaway[2]),
             disable_web_page_preview=True,
             reply_markup=back_to_menu_kb()
         )
 
-@router.message(NFTStates.waiting_for_dice, F.dice.emoji == "🎰")
+@router.message(NFTStates.waiting_for_dice, F.dice.emoji == "🎰", flags={"user_lock": "dice"})
 async def process_slot_dice(message: Message, state: FSMContext):
-    """Обработка броска слот-машины (🎰) - защита от спама"""
+    """Обработка броска слот-машины (🎰) - повторные броски ждут первый"""
     user_id = message.from_user.id
     
-    if user_id in processing_dice:
+    # Повторный бросок дождался замка, а первый уже завершил попытку
+    if await state.get_state() != NFTStates.waiting_for_dice.state:
+        return
+    
+    data = await state.get_data()
+    giveaway_id = data.get("giveaway_id")
+    attempt_id = data.get("attempt_id")
+    nft_link = data.get("nft_link")
+    
+    if not giveaway_id or not attempt_id:
+        await message.answer("❌ Ошибка: данные игры не найдены.")
+        return
+    
+    # Снимок активного розыгрыша в памяти: проверка без запроса к БД
+    giveaway = await get_active_giveaway()
+    if not giveaway or giveaway[0] != giveaway_id:
+        await message.answer("❌ Этот розыгрыш уже завершен!", reply_markup=main_menu_kb())
         return
     
+    dice_value = message.dice.value
+    is_win = (dice_value == 64)
+    
+    # Победа засчитывается, только если этот бросок первым закрыл розыгрыш
+    won = is_win and await claim_win(giveaway_id, user_id)
+    
+    # Результат попытки и сброс FSM ставятся в очередь вместе и уходят одной
+    # групповой записью; показ результата — после анимации, без sleep в хендлере
+    await asyncio.gather(
+        update_attempt_result(attempt_id, "win" if won else "lose", str(dice_value)),
+        clear_state(state),
+    )
+    
+    if not won:
+        # 777 выпало, но розыгрыш уже закрыл другой бросок
+        text = texts.TOO_LATE.render(dice_value=dice_value) if is_win else texts.LOSE.render(dice_value=dice_value)
+        delayed.call_later(DICE_REVEAL_DELAY, send_reveal, message.chat.id, text)
+        return
+    
+    delayed.call_later(
+        DICE_REVEAL_DELAY, send_reveal, message.chat.id, texts.WIN.render(dice_value=dice_value),
+        (giveaway_id, user_id, nft_link)
+    )
+
+async def send_reveal(chat_id: int, text: str, win: Optional[Tuple[int, int, str]] = None):
+    """Показать результат броска; для победы (giveaway_id, user_id, nft_link) — и объявить победителя"""
     try:
-        processing_dice.add(user_id)
-        
-        data = await state.get_data()
-        giveaway_id = data.get("giveaway_id")
-        attempt_id = data.get("attempt_id")
-        nft_link = data.get("nft_link")
-        
-        if not giveaway_id or not attempt_id:
-            await message.answer("❌ Ошибка: данные игры не найдены.")
-            return
-        
-        giveaway = await get_active_giveaway()
-        if not giveaway or giveaway[0] != giveaway_id:
-            await message.answer("❌ Этот розыгрыш уже завершен!", reply_markup=main_menu_kb())
-            return
-        
-        dice_value = message.dice.value
-        is_win = (dice_value == 64)
-        
-        result_status = "win" if is_win else "lose"
-        await update_attempt_result(attempt_id, result_status, str(dice_value))
-        
-        await state.clear()
-        await asyncio.sleep(2)
-        
-        if is_win:
-            await close_giveaway(giveaway_id, user_id)
-            
-            user = await get_user(user_id)
-            user_name = user[2] if user else f"ID:{user_id}"
-            user_link = f"tg://user?id={user_id}"
-            
-            admin_msg = (
-                f"🏆 <b>ПОБЕДИТЕЛЬ В РОЗЫГРЫШЕ NFT!</b>\n\n"
-                f"<blockquote>"
-                f"👤 Победитель: <a href='{user_link}'>{user_name}</a>\n"
-                f"🆔 ID: <code>{user_id}</code>\n"
-                f"🔗 NFT: <a href='{nft_link}'>Ссылка на приз</a>\n"
-                f"🆔 ID розыгрыша: #{giveaway_id}"
-                f"</blockquote>\n\n"
-                f"<b>Отправьте NFT победителю!</b>"
-            )
-            
-            try:
-                await bot.send_message(ADMIN_CHANNEL_ID, admin_msg)
-            except Exception as e:
-                logger.error(f"Ошибка уведомления админа: {e}")
-            
-            all_users = await get_all_users()
-            announce_text = (
-                f"🎉 <b>ПОБЕДИТЕЛЬ ОПРЕДЕЛЕН!</b>\n\n"
-                f"<blockquote>"
-                f"🏆 <b>{user_name}</b> выиграл NFT!\n"
-                f"💎 Приз: <a href='{nft_link}'>NFT Подарок</a>"
-                f"</blockquote>\n\n"
-                f"🍀 <b>Испытайте свою удачу тоже!</b>\n"
-                f"Нажмите '🎰 Получить NFT' в меню!"
-            )
-            
-            await message.answer(
-                f"🎉 <b>ПОЗДРАВЛЯЕМ!</b>\n\n"
-                f"<blockquote>🎰 Выпало: <b>777 {dice_value}</b>\n"
-                f"Вы выиграли NFT!</blockquote>\n\n"
-                f"Администратор свяжется с вами для передачи приза.",
-                reply_markup=main_menu_kb()
-            )
-            
-            asyncio.create_task(broadcast_message(all_users, announce_text, exclude_user=user_id))
-            
-        else:
-            await message.answer(
-                f"😔 <b>Не повезло...</b>\n\n"
-                f"<blockquote>🎰 Выпало: <b>{dice_value}</b> из 64\n\n"
-                f"Нужно было <b>777 (64)</b> для победы!\n\n"
-                f"Хотите попробовать снова? Нажмите '🎰 Получить NFT' в меню!</blockquote>",
-                reply_markup=main_menu_kb()
-            )
-            
+        await bot.send_message(chat_id, text, reply_markup=main_menu_kb())
     finally:
-        await asyncio.sleep(1)
-        processing_dice.discard(user_id)
+        if win is not None:
+            await announce_winner(*win)
+
+async def announce_winner(giveaway_id: int, user_id: int, nft_link: str):
+    """Уведомить админа и запустить рассылку о победителе (вне замка броска)"""
+    user = await get_user(user_id)
+    user_name = user[2] if user else f"ID:{user_id}"
+    
+    admin_msg = texts.WINNER_ADMIN.render(
+        user_id=user_id, user_name=user_name, nft_link=nft_link, giveaway_id=giveaway_id
+    )
+    try:
+        await bot.send_message(ADMIN_CHANNEL_ID, admin_msg)
+    except Exception as e:
+        logger.error(f"Ошибка уведомления админа: {e}")
+    
+    # Текст рассылки рендерится один раз на задание
+    await broadcast_message(
+        texts.WINNER_ANNOUNCE.render(user_name=user_name, nft_link=nft_link), exclude_user=user_id
+    )
 
 @router.message(NFTStates.waiting_for_dice, F.dice)
 async def wrong_dice_type(message: Message):
     await message.answer(
-        "❌ <b>Нужен именно эмодзи Слот-машины</b> 🎰!\n\n"
-        f"Вы отправили: {message.dice.emoji}\n"
+        texts.WRONG_DICE.render(emoji=message.dice.emoji)
     )
 
 @router.message(NFTStates.waiting_for_dice)
@@ -556,11 +534,7 @@ async def admin_panel(message: Message):
         await message.answer("❌ Доступ запрещен!")
         return
     
-    admin_text = (
-        f"👑 <b>ПАНЕЛЬ АДМИНИСТРАТОРА</b>\n\n"
-        f"Добро пожаловать, <b>{message.from_user.full_name}</b>!\n\n"
-        f"<blockquote>Выберите раздел:</blockquote>"
-    )
+    admin_text = texts.ADMIN_WELCOME.render(full_name=message.from_user.full_name)
     
     await message.answer(admin_text, reply_markup=admin_menu_kb())
 
@@ -570,93 +544,39 @@ async def admin_full_stats(callback: CallbackQuery):
         await callback.answer("❌ Доступ запрещен!", show_alert=True)
         return
     
-    try:
-        async with aiosqlite.connect("bot_database.db") as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM users")
-            total_users = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM users WHERE date(joined_date) = date('now')"
-            )
-            new_today = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COALESCE(SUM(amount), 0) FROM withdrawal_requests WHERE status = 'paid'"
-            )
-            total_paid = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COALESCE(SUM(amount), 0) FROM withdrawal_requests WHERE status = 'pending'"
-            )
-            pending_amount = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute("SELECT COUNT(*) FROM withdrawal_requests")
-            total_withdrawals = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute("SELECT COUNT(*) FROM withdrawal_requests WHERE status = 'pending'")
-            pending_count = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute("SELECT COUNT(*) FROM withdrawal_requests WHERE status = 'paid'")
-            paid_count = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute("SELECT COUNT(*) FROM nft_giveaways WHERE is_active = 1")
-            active_giveaways = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM nft_giveaways WHERE winner_id IS NOT NULL"
-            )
-            completed_giveaways = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute("SELECT COUNT(*) FROM nft_giveaways")
-            total_giveaways = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM nft_attempts WHERE giveaway_id IN "
-                "(SELECT id FROM nft_giveaways WHERE is_active = 1)"
-            )
-            current_attempts = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT username, referrals_count, stars_earned FROM users ORDER BY referrals_count DESC LIMIT 5"
-            )
-            top_refs = await cursor.fetchall()
-    
-    except Exception as e:
-        logger.error(f"Ошибка получения статистики: {e}")
+    stats = await get_bot_stats()
+    if stats is None:
         await callback.answer("❌ Ошибка загрузки статистики!", show_alert=True)
         return
     
-    stats_text = (
-        f"📊 <b>ПОДРОБНАЯ СТАТИСТИКА БОТА</b>\n\n"
-        f"<b>👥 Пользователи:</b>\n"
-        f"<blockquote>"
-        f"├ Всего: <b>{total_users}</b>\n"
-        f"├ Новых сегодня: <b>{new_today}</b>\n"
-        f"└ Рефералов всего: <b>{sum([r[1] for r in top_refs])}</b>"
-        f"</blockquote>\n\n"
-        f"<b>💸 Выводы Stars:</b>\n"
-        f"<blockquote>"
-        f"├ Всего заявок: <b>{total_withdrawals}</b>\n"
-        f"├ В обработке: <b>{pending_count}</b>\n"
-        f"├ Выплачено: <b>{paid_count}</b>\n"
-        f"├ Всего выплачено: <b>{total_paid}</b> ⭐\n"
-        f"└ В ожидании: <b>{pending_amount}</b> ⭐"
-        f"</blockquote>\n\n"
-        f"<b>🎰 NFT Розыгрыши:</b>\n"
-        f"<blockquote>"
-        f"├ Активных: <b>{active_giveaways}</b>\n"
-        f"├ Проведено: <b>{completed_giveaways}</b>\n"
-        f"├ Всего создано: <b>{total_giveaways}</b>\n"
-        f"└ Попыток в текущем: <b>{current_attempts}</b>"
-        f"</blockquote>\n\n"
-        f"<b>🏆 Топ-5 рефереров:</b>\n<blockquote>"
+    cache_stats = user_cache.stats()
+    lock_stats = user_locks.stats()
+    checkout_stats = pre_checkout_latency.stats()
+    stats_text = texts.ADMIN_STATS.render(
+        **stats,
+        cache_size=cache_stats['size'],
+        cache_maxsize=cache_stats['maxsize'],
+        cache_hits=cache_stats['hits'],
+        cache_hit_rate=cache_stats['hit_rate'],
+        cache_misses=cache_stats['misses'],
+        cache_evictions=cache_stats['evictions'],
+        lock_active=lock_stats['active'],
+        lock_acquired=lock_stats['acquired'],
+        lock_contended=lock_stats['contended'],
+        lock_wait_avg=lock_stats['wait_avg'],
+        lock_wait_max=lock_stats['wait_max'],
+        lock_timeouts=lock_stats['timeouts'],
+        checkout_count=checkout_stats['count'],
+        checkout_slow=checkout_stats['slow'],
+        checkout_avg_ms=checkout_stats['avg'] * 1000,
+        checkout_p95_ms=checkout_stats['p95'] * 1000,
+        checkout_max_ms=checkout_stats['max'] * 1000
     )
     
-    for idx, (username, refs, stars) in enumerate(top_refs, 1):
-        name = f"@{username}" if username else f"ID:{idx}"
-        stats_text += f"{idx}. {name} — {refs} ref / {stars} ⭐\n"
-    
-    stats_text += "</blockquote>"
+    stats_text += texts.ADMIN_TOP_ROW.render_many(
+        {"idx": idx, "name": texts.top_name(user_id, username), "refs": refs, "stars": stars}
+        for idx, (user_id, username, refs, stars) in enumerate(leaderboard.top[:5], 1)
+    ) + "</blockquote>"
     
     await callback.message.edit_text(stats_text, reply_markup=admin_back_kb())
     await callback.answer()
@@ -671,24 +591,18 @@ async def admin_giveaway_menu(callback: CallbackQuery):
     
     if giveaway:
         stats = await get_giveaway_stats(giveaway[0])
-        text = (
-            f"🎰 <b>УПРАВЛЕНИЕ РОЗЫГРЫШАМИ</b>\n\n"
-            f"<b>🔥 Активен розыгрыш #{giveaway[0]}</b>\n\n"
-            f"<blockquote>"
-            f"💰 Ставка: {giveaway[1]} Stars\n"
-            f"💎 NFT: <a href='{giveaway[2]}'>Ссылка на приз</a>\n"
-            f"👥 Уникальных игроков: {stats['unique_users']}\n"
-            f"🎲 Всего попыток: {stats['total_attempts']}\n"
-            f"📅 Создан: {giveaway[6][:10] if giveaway[6] else 'Неизвестно'}"
-            f"</blockquote>\n\n"
-            f"Выберите действие:"
+        text = texts.ADMIN_GIVEAWAY_ACTIVE.render(
+            giveaway_id=giveaway[0],
+            bet_amount=giveaway[1],
+            nft_link=giveaway[2],
+            unique_users=stats['unique_users'],
+            total_attempts=stats['total_attempts'],
+            stars_collected=stats['stars_collected'],
+            created=texts.short_date(giveaway[6])
         )
         kb = admin_giveaway_manage_kb(has_active=True)
     else:
-        text = (
-            f"🎰 <b>УПРАВЛЕНИЕ РОЗЫГРЫШАМИ</b>\n\n"
-            f"<blockquote>Сейчас нет активных розыгрышей.</blockquote>"
-        )
+        text = texts.ADMIN_GIVEAWAY_NONE
         kb = admin_giveaway_manage_kb(has_active=False)
     
     await callback.message.edit_text(text, reply_markup=kb, disable_web_page_preview=True)
@@ -724,10 +638,7 @@ async def admin_process_bet_amount(message: Message, state: FSMContext):
     await state.set_state(AdminStates.waiting_for_nft_link)
     
     await message.answer(
-        "🎰 <b>СОЗДАНИЕ НОВОГО РОЗЫГРЫША</b>\n\n"
-        f"<b>Шаг 1:</b> ✅ Ставка: {bet_amount} Stars\n"
-        f"<b>Шаг 2/2:</b> Отправьте ссылку на NFT приз\n\n"
-        f"<i>Пример: https://t.me/nft/mygift</i>",
+        texts.ADMIN_ASK_NFT_LINK.render(bet_amount=bet_amount),
         reply_markup=admin_cancel_kb()
     )
 
@@ -750,30 +661,14 @@ async def admin_process_nft_link(message: Message, state: FSMContext):
     
     if giveaway_id:
         await message.answer(
-            f"✅ <b>Розыгрыш #{giveaway_id} создан!</b>\n\n"
-            f"<blockquote>"
-            f"💰 Ставка: {bet_amount} Stars\n"
-            f"💎 NFT: {nft_link}\n"
-            f"🎰 Условие: Выпадение 777 (64)"
-            f"</blockquote>\n\n"
-            f"Начинаю рассылку уведомлений...",
+            texts.GIVEAWAY_CREATED.render(giveaway_id=giveaway_id, bet_amount=bet_amount, nft_link=nft_link),
             reply_markup=admin_menu_kb(),
             disable_web_page_preview=True
         )
         
-        all_users = await get_all_users()
-        announce_text = (
-            f"🎰 <b>НОВЫЙ РОЗЫГРЫШ NFT!</b>\n\n"
-            f"<blockquote>"
-            f"💎 Новый приз разыгрывается!\n"
-            f"💰 Ставка: {bet_amount} Stars\n"
-            f"🎯 Условие: Выпадение 777 (64)\n"
-            f"🔗 <a href='{nft_link}'>Посмотреть приз</a>"
-            f"</blockquote>\n\n"
-            f"<b>🍀 Испытайте удачу!</b> Нажмите '🎰 Получить NFT' в меню!"
-        )
+        announce_text = texts.GIVEAWAY_ANNOUNCE.render(bet_amount=bet_amount, nft_link=nft_link)
         
-        asyncio.create_task(broadcast_message(all_users, announce_text))
+        await broadcast_message(announce_text)
         logger.info(f"Админ создал розыгрыш #{giveaway_id}")
     else:
         await message.answer("❌ Ошибка создания розыгрыша!", reply_markup=admin_menu_kb())
@@ -791,17 +686,13 @@ async def admin_stop_current_giveaway(callback: CallbackQuery):
         await callback.answer("❌ Нет активных розыгрышей!", show_alert=True)
         return
     
-    async with aiosqlite.connect("bot_database.db") as db:
-        await db.execute(
-            "UPDATE nft_giveaways SET is_active = 0, ended_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (giveaway[0],)
-        )
-        await db.commit()
+    if not await stop_giveaway(giveaway[0]):
+        await callback.answer("❌ Ошибка завершения розыгрыша!", show_alert=True)
+        return
     
     await callback.message.edit_text(
-        f"✅ <b>Розыгрыш #{giveaway[0]} завершен!</b>\n\n"
-        f"<blockquote>Статистика сохранена в истории.</blockquote>",
-        reply_markup=admin_giveaway_menu()
+        texts.ADMIN_GIVEAWAY_STOPPED.render(giveaway_id=giveaway[0]),
+        reply_markup=admin_giveaway_manage_kb(has_active=False)
     )
     await callback.answer("Розыгрыш завершен!")
 
@@ -812,11 +703,9 @@ async def admin_giveaway_history(callback: CallbackQuery):
         return
     
     try:
-        async with aiosqlite.connect("bot_database.db") as db:
-            cursor = await db.execute(
-                "SELECT * FROM nft_giveaways WHERE is_active = 0 ORDER BY ended_at DESC LIMIT 5"
-            )
-            history = await cursor.fetchall()
+        history = await pool.fetchall(
+            "SELECT * FROM nft_giveaways WHERE is_active = 0 ORDER BY ended_at DESC LIMIT 5"
+        )
     except Exception as e:
         logger.error(f"Ошибка: {e}")
         await callback.answer("❌ Ошибка загрузки!", show_alert=True)
@@ -825,23 +714,65 @@ async def admin_giveaway_history(callback: CallbackQuery):
     if not history:
         text = "📜 <b>История розыгрышей</b>\n\n<blockquote>Пока нет завершенных розыгрышей.</blockquote>"
     else:
-        text = "📜 <b>ПОСЛЕДНИЕ ЗАВЕРШЕННЫЕ РОЗЫГРЫШИ</b>\n\n"
-        
+        rows = []
         for row in history:
             giveaway_id, bet_amount, nft_link, is_active, created_by, winner_id, created_at, ended_at = row
             winner = await get_user(winner_id) if winner_id else None
-            winner_name = winner[2] if winner else "Никто (завершен админом)"
-            
-            text += (
-                f"<blockquote><b>#{giveaway_id}</b>\n"
-                f"💰 Ставка: {bet_amount} Stars\n"
-                f"🏆 Победитель: {winner_name}\n"
-                f"📅 {ended_at[:10] if ended_at else 'Неизвестно'}</blockquote>\n\n"
-            )
+            rows.append({
+                "giveaway_id": giveaway_id,
+                "bet_amount": bet_amount,
+                "winner_name": winner[2] if winner else "Никто (завершен админом)",
+                "ended": texts.short_date(ended_at),
+            })
+        text = texts.HISTORY_HEADER + texts.HISTORY_ROW.render_many(rows)
     
     await callback.message.edit_text(text, reply_markup=admin_back_kb())
     await callback.answer()
 
+@router.callback_query(F.data == "admin_broadcast")
+async def admin_broadcasts(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("❌ Доступ запрещен!", show_alert=True)
+        return
+    
+    jobs = await get_recent_broadcast_jobs(5)
+    
+    if not jobs:
+        text = "📢 <b>Рассылки</b>\n\n<blockquote>Рассылок пока не было.</blockquote>"
+    else:
+        rows = []
+        for job_id, status, total, sent, failed, created_at in jobs:
+            # У идущей рассылки счетчики в памяти свежее, чем в БД
+            progress = broadcast_jobs.active.get(job_id) if status == "running" else None
+            if progress is not None:
+                sent, failed = progress.sent, progress.failed
+            done = sent + failed
+            percent = done * 100 // total if total else 100
+            
+            if progress is not None:
+                eta = f", осталось ~{int(progress.eta // 60)} мин" if progress.eta is not None else ""
+                tail = f"Скорость: {progress.throughput:.1f} сообщ/с{eta}"
+            else:
+                tail = f"Создана: {texts.short_date(created_at, 16)}"
+            rows.append({
+                "job_id": job_id,
+                "status": texts.BROADCAST_STATUS_TEXT.get(status, status),
+                "done": done,
+                "total": total,
+                "percent": percent,
+                "sent": sent,
+                "failed": failed,
+                "tail": tail,
+            })
+        text = texts.BROADCASTS_HEADER + texts.BROADCAST_ROW.render_many(rows)
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=admin_broadcasts_kb())
+    except TelegramBadRequest:
+        # «message is not modified» при повторном нажатии «Обновить»
+        pass
+    await callback.answer()
+
 @router.callback_query(F.data == "admin_menu")
 async def admin_back_to_menu(callback: CallbackQuery, state: FSMContext = None):
     if callback.from_user.id != ADMIN_ID:
@@ -895,22 +826,18 @@ async def mark_as_paid(callback: CallbackQuery):
     try:
         await bot.send_message(
             user_id,
-            f"🎉 <b>Заявка #{request_id} выплачена!</b>\n\n"
-            f"<blockquote>"
-            f"💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
-            f"✅ Статус: Выплачено\n"
-            f"🎊 Средства отправлены на ваш кошелек"
-            f"</blockquote>\n\n"
-            f"💎 Спасибо за использование бота!",
+            texts.WITHDRAWAL_PAID.render(request_id=request_id, amount=amount),
             reply_markup=main_menu_kb()
         )
     except Exception as e:
         logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
     
     await callback.message.edit_text(
-        f"{callback.message.text}\n\n"
-        f"<b>✅ Статус обновлен: Выплачено</b>\n"
-        f"👤 Админ: @{callback.from_user.username or 'скрыт'}",
+        texts.WITHDRAWAL_PROCESSED.render(
+            request_text=callback.message.text or "",
+            status_line=texts.WITHDRAWAL_PROCESSED_STATUS["paid"],
+            admin=callback.from_user.username or 'скрыт'
+        ),
         reply_markup=None
     )
     await callback.answer("✅ Статус изменен!")
@@ -944,22 +871,18 @@ async def mark_as_rejected(callback: CallbackQuery):
     try:
         await bot.send_message(
             user_id,
-            f"❌ <b>Заявка #{request_id} отклонена</b>\n\n"
-            f"<blockquote>"
-            f"💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
-            f"📛 Статус: Отклонено\n"
-            f"💎 Средства возвращены на ваш баланс\n"
-            f"❓ Свяжитесь с администратором для уточнения"
-            f"</blockquote>",
+            texts.WITHDRAWAL_REJECTED.render(request_id=request_id, amount=amount),
             reply_markup=main_menu_kb()
         )
     except Exception as e:
         logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
     
     await callback.message.edit_text(
-        f"{callback.message.text}\n\n"
-        f"<b>❌ Статус обновлен: Отклонено</b>\n"
-        f"👤 Админ: @{callback.from_user.username or 'скрыт'}",
+        texts.WITHDRAWAL_PROCESSED.render(
+            request_text=callback.message.text or "",
+            status_line=texts.WITHDRAWAL_PROCESSED_STATUS["rejected"],
+            admin=callback.from_user.username or 'скрыт'
+        ),
         reply_markup=None
     )
     await callback.answer("✅ Статус изменен!")
@@ -975,16 +898,10 @@ async def back_to_menu(callback: CallbackQuery, state: FSMContext = None):
         await callback.answer("❌ Пользователь не найден!", show_alert=True)
         return
     
-    menu_text = (
-        f"<b>🏠 Главное меню</b>\n\n"
-        f"Привет, <b>{user_data[2] or 'Пользователь'}</b>! 👋\n\n"
-        f"<blockquote>"
-        f"💎 Баланс: <b>{user_data[5]} ⭐ звезд</b>\n"
-        f"👥 Рефералы: <b>{user_data[4]} человек</b>\n"
-        f"🎯 Каждый друг = 1 звезда!\n"
-        f"🎰 NFT розыгрыши активны!"
-        f"</blockquote>\n\n"
-        f"<b>Выберите действие:</b>"
+    menu_text = texts.MAIN_MENU.render(
+        full_name=texts.user_name(user_data[2], "Пользователь"),
+        stars=user_data[5],
+        referrals=user_data[4],
     )
     
     try:
@@ -995,53 +912,84 @@ async def back_to_menu(callback: CallbackQuery, state: FSMContext = None):
     await callback.answer()
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
-async def broadcast_message(user_ids: list, text: str, exclude_user: int = None):
-    """Рассылка сообщения всем пользователям"""
-    success = 0
-    failed = 0
-    
-    for user_id in user_ids:
-        if user_id == exclude_user:
-            continue
-        try:
-            await bot.send_message(user_id, text, reply_markup=main_menu_kb())
-            success += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            failed += 1
-    
-    if success > 0 or failed > 0:
-        logger.info(f"Рассылка завершена: успешно {success}, ошибок {failed}")
+async def broadcast_message(text: str, exclude_user: int = None):
+    """Запустить рассылку всем пользователям (задание в БД, переживает рестарт)"""
+    job_id = await broadcast_jobs.start(text, exclude_user=exclude_user)
+    if job_id is None:
+        logger.error("Не удалось создать задание рассылки")
 
 async def get_user_attempts_count(giveaway_id: int, user_id: int) -> int:
     try:
-        async with aiosqlite.connect("bot_database.db") as db:
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM nft_attempts WHERE giveaway_id = ? AND user_id = ?",
-                (giveaway_id, user_id)
-            )
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        result = await pool.fetchone(
+            "SELECT COUNT(*) FROM nft_attempts WHERE giveaway_id = ? AND user_id = ?",
+            (giveaway_id, user_id)
+        )
+        return result[0] if result else 0
     except:
         return 0
 
+async def on_startup(primary: bool = True):
+    """
+    Подготовка процесса к обработке апдейтов. primary=False — воркер
+    из workers.py: без обслуживания БД и возобновления рассылок (их ведет
+    основной воркер).
+    """
+    await init_db(maintenance=primary)
+    await runtime.start()
+    delayed.start()
+    # Рассылки ведет только основной процесс: лимит BROADCAST_RATE общий на бота
+    broadcast_jobs.owner = primary
+    if primary:
+        logger.info("🚀 Бот запущен!")
+        logger.info("📊 Реферальная система активна")
+        logger.info("🎰 NFT розыгрыши активны (ОПЛАТА ВКЛЮЧЕНА)")
+        logger.info(f"💸 Админский канал: {ADMIN_CHANNEL_ID}")
+        logger.info(f"👑 Админ ID: {ADMIN_ID}")
+        logger.info(f"📏 Минимум рефералов: {MIN_REFERRALS}, минимум звезд: {MIN_STARS_WITHDRAW}")
+        
+        try:
+            chat = await bot.get_chat(ADMIN_CHANNEL_ID)
+            logger.info(f"✅ Доступ к каналу '{chat.title}' получен")
+        except Exception as e:
+            logger.error(f"❌ Нет доступа к админ-каналу {ADMIN_CHANNEL_ID}: {e}")
+            logger.error("Добавьте бота в канал как администратора!")
+    
+    await leaderboard.start()
+    if primary:
+        await broadcast_jobs.resume()
+        broadcast_listeners.append(broadcast_jobs.adopt)
+
+async def on_shutdown():
+    # Сначала отложенные ответы: они могут запустить рассылку
+    await delayed.stop()
+    if broadcast_jobs.adopt in broadcast_listeners:
+        broadcast_listeners.remove(broadcast_jobs.adopt)
+    await broadcast_jobs.stop()
+    await leaderboard.stop()
+    await runtime.stop()
+    await shared_locks.close()
+    await storage.close()
+    await close_db()
+
 async def main():
-    await init_db()
-    logger.info("🚀 Бот запущен!")
-    logger.info("📊 Реферальная система активна")
-    logger.info("🎰 NFT розыгрыши активны (ОПЛАТА ВКЛЮЧЕНА)")
-    logger.info(f"💸 Админский канал: {ADMIN_CHANNEL_ID}")
-    logger.info(f"👑 Админ ID: {ADMIN_ID}")
-    logger.info(f"📏 Минимум рефералов: {MIN_REFERRALS}, минимум звезд: {MIN_STARS_WITHDRAW}")
+    await on_startup()
     
     try:
-        chat = await bot.get_chat(ADMIN_CHANNEL_ID)
-        logger.info(f"✅ Доступ к каналу '{chat.title}' получен")
-    except Exception as e:
-        logger.error(f"❌ Нет доступа к админ-каналу {ADMIN_CHANNEL_ID}: {e}")
-        logger.error("Добавьте бота в канал как администратора!")
-    
-    await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                public_url=WEBHOOK_URL,
+                secret=WEBHOOK_SECRET,
+                max_concurrency=WEBHOOK_MAX_CONCURRENCY,
+            )
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
     try:
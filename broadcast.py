@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from typing import Optional, Union, Iterable, AsyncIterable, AsyncIterator, Dict, List, Tuple, Any, Callable, Awaitable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError,
+    TelegramForbiddenError, TelegramBadRequest
+)
+
+from database import (
+    iter_user_id_chunks, count_users, create_broadcast_job, get_unfinished_broadcast_jobs,
+    get_broadcast_delivered, record_broadcast_progress, finish_broadcast_job, announce_broadcast_job
+)
+
+logger = logging.getLogger(__name__)
+
+Recipients = Union[Iterable[int], AsyncIterable[int]]
+# Вызывается после каждой попытки доставки: on_result(chat_id, outcome)
+ResultCallback = Callable[[int, str], Awaitable[None]]
+
+# Исходы отправки: доставлено, временная ошибка и постоянные причины недоступности
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+DEACTIVATED = "deactivated"
+CHAT_NOT_FOUND = "chat_not_found"
+UNREACHABLE_OUTCOMES = (BLOCKED, DEACTIVATED, CHAT_NOT_FOUND)
+
+def classify_error(error: Exception) -> str:
+    """Постоянная причина недоступности чата или FAILED, если ошибка временная"""
+    message = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in message:
+            return DEACTIVATED
+        if "chat not found" in message:
+            return CHAT_NOT_FOUND
+        return BLOCKED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in message:
+        return CHAT_NOT_FOUND
+    return FAILED
+
+class TokenBucket:
+    """Глобальный лимит отправки: rate сообщений в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (Telegram ответил 429 с retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Пауза не копит токены: после нее отправка идет с темпом rate, без всплеска
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class PerChatLimiter:
+    """Не чаще одного сообщения в чат раз в interval секунд"""
+
+    def __init__(self, interval: float = 1.0, max_chats: int = 100000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_allowed: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready_at = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, ready_at) + self.interval
+        if len(self._next_allowed) > self.max_chats:
+            self._next_allowed = {
+                chat: ts for chat, ts in self._next_allowed.items() if ts > now
+            }
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+class BroadcastProgress:
+    """Счетчики рассылки: отправлено, ошибок, скорость и оставшееся время"""
+
+    def __init__(self, total: Optional[int] = None):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.retries = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Сообщений в секунду с начала рассылки"""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Секунд до конца (если известно общее число получателей)"""
+        if self.total is None or not self.throughput:
+            return None
+        return max(0, self.total - self.done) / self.throughput
+
+    def summary(self) -> str:
+        total = f"/{self.total}" if self.total is not None else ""
+        eta = f", осталось ~{int(self.eta)} с" if self.eta is not None else ""
+        return (
+            f"{self.done}{total} (успешно {self.sent}, ошибок {self.failed}, "
+            f"недоступны {self.unreachable}), "
+            f"{self.throughput:.1f} сообщ/с{eta}"
+        )
+
+async def _iterate(recipients: Recipients) -> AsyncIterator[int]:
+    if hasattr(recipients, "__aiter__"):
+        async for user_id in recipients:
+            yield user_id
+    else:
+        for user_id in recipients:
+            yield user_id
+
+class Broadcaster:
+    """
+    Рассылка с глобальным token bucket, лимитом на чат и N параллельными
+    отправителями. На 429 ждет retry_after (и притормаживает всех),
+    сетевые и 5xx ошибки повторяет с экспоненциальной паузой.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = 25.0,
+        concurrency: int = 8,
+        per_chat_interval: float = 1.0,
+        max_retries: int = 3,
+        report_interval: float = 30.0,
+    ):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat = PerChatLimiter(per_chat_interval)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+
+    async def run(
+        self,
+        recipients: Recipients,
+        text: str,
+        exclude_user: Optional[int] = None,
+        total: Optional[int] = None,
+        progress: Optional[BroadcastProgress] = None,
+        **send_kwargs: Any,
+    ) -> BroadcastProgress:
+        """Разослать text всем recipients; send_kwargs уходят в send_message"""
+        progress = progress or BroadcastProgress(total)
+        reporter = asyncio.create_task(self.report_progress(progress))
+        try:
+            await self.deliver(recipients, text, progress, exclude_user=exclude_user, **send_kwargs)
+        finally:
+            reporter.cancel()
+            progress.finished_at = time.monotonic()
+
+        logger.info(f"Рассылка завершена: {progress.summary()}")
+        return progress
+
+    async def deliver(
+        self,
+        recipients: Recipients,
+        text: str,
+        progress: BroadcastProgress,
+        exclude_user: Optional[int] = None,
+        on_result: Optional[ResultCallback] = None,
+        **send_kwargs: Any,
+    ):
+        """Отправить всем recipients параллельно и дождаться окончания"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    outcome = await self.send(chat_id, text, progress, **send_kwargs)
+                    if outcome == SENT:
+                        progress.sent += 1
+                    else:
+                        progress.failed += 1
+                        if outcome in UNREACHABLE_OUTCOMES:
+                            progress.unreachable += 1
+                    if on_result is not None:
+                        await on_result(chat_id, outcome)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки получателя {chat_id}: {e}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for chat_id in _iterate(recipients):
+                if chat_id != exclude_user:
+                    await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def send(self, chat_id: int, text: str, progress: BroadcastProgress, **send_kwargs: Any) -> str:
+        """Одно сообщение с повторами; возвращает исход (SENT, FAILED или причину недоступности)"""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            await self.per_chat.wait(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, **send_kwargs)
+                return SENT
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                delay = e.retry_after
+            except (TelegramNetworkError, TelegramServerError):
+                delay = 2 ** attempt
+            except Exception as e:
+                return classify_error(e)
+            if attempt < self.max_retries:
+                progress.retries += 1
+                await asyncio.sleep(delay)
+        return FAILED
+
+    async def report_progress(self, progress: BroadcastProgress):
+        """Периодически логировать прогресс (задача отменяется снаружи)"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logger.info(f"Рассылка: {progress.summary()}")
+
+class BroadcastJobs:
+    """
+    Рассылки как задания в SQLite. Получатели идут страницами по user_id;
+    после каждой страницы чекпоинт (last_user_id) сдвигается, доставки
+    пишутся пачками по flush_size. После рестарта resume() продолжает
+    незавершенные задания с чекпоинта, пропуская уже доставленных.
+    Заблокировавшие бота и удаленные аккаунты помечаются недоступными в той же
+    транзакции и в следующие рассылки не попадают.
+    owner=False (не основной воркер) — задания только создаются и передаются
+    основному: у каждого процесса свой token bucket, и общий лимит BROADCAST_RATE
+    иначе умножился бы на число воркеров.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, chunk_size: int = 500, flush_size: int = 100, **send_kwargs: Any):
+        self.broadcaster = broadcaster
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.send_kwargs = send_kwargs
+        self.owner = True
+        self.active: Dict[int, BroadcastProgress] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def start(self, text: str, exclude_user: Optional[int] = None) -> Optional[int]:
+        """Создать задание и запустить его в фоне; возвращает id задания"""
+        total = await count_users(reachable_only=True)
+        if exclude_user is not None:
+            total = max(0, total - 1)
+        job_id = await create_broadcast_job(text, exclude_user, total)
+        if job_id is None:
+            return None
+        if not self.owner:
+            announce_broadcast_job(job_id)
+            logger.info(f"Рассылка #{job_id} передана основному воркеру, получателей: {total}")
+            return job_id
+        self._spawn(job_id, text, exclude_user, BroadcastProgress(total), checkpoint=0)
+        logger.info(f"Рассылка #{job_id} запущена, получателей: {total}")
+        return job_id
+
+    async def adopt(self, job_id: int):
+        """Запустить задание, созданное другим процессом"""
+        if self.owner and job_id not in self._tasks:
+            await self.resume()
+
+    async def resume(self):
+        """Продолжить задания, прерванные прошлой остановкой бота (и еще не идущие здесь)"""
+        for job_id, text, exclude_user, total, sent, failed, last_user_id in await get_unfinished_broadcast_jobs():
+            if job_id in self._tasks:
+                continue
+            progress = BroadcastProgress(total)
+            progress.sent = sent
+            progress.failed = failed
+            self._spawn(job_id, text, exclude_user, progress, checkpoint=last_user_id)
+            logger.info(f"Рассылка #{job_id} возобновлена с user_id > {last_user_id} ({sent + failed}/{total})")
+
+    async def stop(self):
+        """Остановить фоновые рассылки (прогресс сохраняется, resume() продолжит)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, job_id: int, text: str, exclude_user: Optional[int], progress: BroadcastProgress, checkpoint: int):
+        self.active[job_id] = progress
+        task = asyncio.create_task(self._run(job_id, text, exclude_user, progress, checkpoint))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._forget(job_id))
+
+    def _forget(self, job_id: int):
+        self._tasks.pop(job_id, None)
+        self.active.pop(job_id, None)
+
+    async def _run(self, job_id: int, text: str, exclude_user: Optional[int], progress: BroadcastProgress, checkpoint: int):
+        pending: List[Tuple[int, str]] = []
+        unreachable: List[Tuple[int, str]] = []
+        already_delivered = await get_broadcast_delivered(job_id, checkpoint)
+
+        async def flush(last_user_id: Optional[int] = None):
+            nonlocal pending, unreachable
+            batch, pending = pending, []
+            pruned, unreachable = unreachable, []
+            # Запись не отменяется вместе с рассылкой: откат транзакции при
+            # остановке бота потерял бы пачку, и после resume() эти получатели
+            # получили бы сообщение повторно
+            write = asyncio.ensure_future(record_broadcast_progress(job_id, batch, last_user_id, pruned))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                if not write.done():
+                    await asyncio.wait([write])
+                if write.cancelled() or write.exception() is not None:
+                    pending = batch + pending
+                    unreachable = pruned + unreachable
+                raise
+            except Exception:
+                # Запись не удалась — возвращаем пачку (перед тем, что пришло за время записи)
+                pending = batch + pending
+                unreachable = pruned + unreachable
+                raise
+
+        async def on_result(chat_id: int, outcome: str):
+            pending.append((chat_id, SENT if outcome == SENT else FAILED))
+            if outcome in UNREACHABLE_OUTCOMES:
+                unreachable.append((chat_id, outcome))
+            if len(pending) >= self.flush_size:
+                await flush()
+
+        reporter = asyncio.create_task(self.broadcaster.report_progress(progress))
+        try:
+            async for chunk in iter_user_id_chunks(self.chunk_size, after=checkpoint):
+                recipients = [user_id for user_id in chunk if user_id not in already_delivered]
+                await self.broadcaster.deliver(
+                    recipients, text, progress,
+                    exclude_user=exclude_user, on_result=on_result, **self.send_kwargs
+                )
+                await flush(last_user_id=chunk[-1])
+            await finish_broadcast_job(job_id, "done")
+            progress.finished_at = time.monotonic()
+            logger.info(f"Рассылка #{job_id} завершена: {progress.summary()}")
+        except asyncio.CancelledError:
+            # Дописываем то, что успели отправить, чтобы не слать повторно
+            await flush()
+            raise
+        except Exception as e:
+            # Задание остается 'running' намеренно: resume() при следующем
+            # запуске продолжит его с чекпоинта, пропустив уже доставленных
+            logger.error(f"Ошибка рассылки #{job_id}: {e}; продолжится после перезапуска")
+            try:
+                await flush()
+            except Exception as flush_error:
+                logger.error(f"Не удалось сохранить прогресс рассылки #{job_id}: {flush_error}")
+        finally:
+            reporter.cancel()
+            if progress.finished_at is None:
+                progress.finished_at = time.monotonic()
@@ -2,6 +2,11 @@ import os
 from typing import Optional
 
 
+def _env_int(name: str) -> Optional[int]:
+    """Целое из окружения или None, если переменная не задана"""
+    value = os.getenv(name)
+    return int(value) if value else None
+
 
 BOT_TOKEN: str = os.getenv("BOT_TOKEN", "8291003872:AAFxBi9P-OfozsyunB9sXdl0iWBWioj7Ty0")
 ADMIN_CHANNEL_ID: int = int(os.getenv("ADMIN_CHANNEL_ID", "-1003701054266"))
@@ -10,6 +15,92 @@ ADMIN_ID: int = int(os.getenv("ADMIN_ID", "8535833319"))
 # Минимальные требования для вывода
 MIN_REFERRALS: int = int(os.getenv("MIN_REFERRALS", "15"))
 MIN_STARS_WITHDRAW: int = int(os.getenv("MIN_STARS_WITHDRAW", "15"))
+# Сколько заявок на вывод может одновременно ждать решения
+MAX_PENDING_WITHDRAWALS: int = int(os.getenv("MAX_PENDING_WITHDRAWALS", "3"))
+
+# Пул соединений SQLite (читатели; писатель всегда один)
+DB_POOL_READERS: int = int(os.getenv("DB_POOL_READERS", "4"))
+
+# Профиль хранилища SQLite: safe / balanced / fast (см. database.STORAGE_PROFILES)
+DB_PROFILE: str = os.getenv("DB_PROFILE", "balanced")
+# Точечные переопределения PRAGMA поверх профиля (пусто = из профиля)
+DB_JOURNAL_MODE: Optional[str] = os.getenv("DB_JOURNAL_MODE") or None
+DB_SYNCHRONOUS: Optional[str] = os.getenv("DB_SYNCHRONOUS") or None
+DB_CACHE_SIZE: Optional[int] = _env_int("DB_CACHE_SIZE")
+DB_MMAP_SIZE: Optional[int] = _env_int("DB_MMAP_SIZE")
+DB_TEMP_STORE: Optional[str] = os.getenv("DB_TEMP_STORE") or None
+DB_BUSY_TIMEOUT: Optional[int] = _env_int("DB_BUSY_TIMEOUT")
+# Период фонового PRAGMA optimize + wal_checkpoint, секунды (0 = выключено)
+DB_MAINTENANCE_INTERVAL: int = int(os.getenv("DB_MAINTENANCE_INTERVAL", "600"))
+
+# Групповая запись: сброс очереди раз в N мс или по накоплении M операций
+DB_BATCH_INTERVAL_MS: int = int(os.getenv("DB_BATCH_INTERVAL_MS", "20"))
+DB_BATCH_MAX_OPS: int = int(os.getenv("DB_BATCH_MAX_OPS", "100"))
+
+# Кэш строк users в памяти: максимум записей и время жизни, секунды
+USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Лидерборд: размер топа и период полного пересчета, секунды
+LEADERBOARD_SIZE: int = int(os.getenv("LEADERBOARD_SIZE", "10"))
+LEADERBOARD_REFRESH: float = float(os.getenv("LEADERBOARD_REFRESH", "60"))
+
+# Сколько секунд админская статистика отдается из кэша
+STATS_CACHE_TTL: float = float(os.getenv("STATS_CACHE_TTL", "5"))
+
+# Рассылки: общий лимит сообщений/с, параллельные отправители, пауза между
+# сообщениями в один чат и число повторов при 429/сетевых ошибках
+BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_PER_CHAT_INTERVAL: float = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+BROADCAST_MAX_RETRIES: int = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# Сколько user_id читать из БД за один запрос при рассылке
+BROADCAST_CHUNK_SIZE: int = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+
+# Адрес Bot API (например, локальный тестовый сервер); пусто = api.telegram.org
+TELEGRAM_API_URL: Optional[str] = os.getenv("TELEGRAM_API_URL") or None
+
+# Режим получения апдейтов: polling (long polling) или webhook (aiohttp-сервер)
+BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+# Вебхук: адрес и путь, на которых слушает сервер
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный адрес (https://bot.example.com) для setWebhook; пусто = не регистрировать
+WEBHOOK_URL: Optional[str] = os.getenv("WEBHOOK_URL") or None
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET: Optional[str] = os.getenv("WEBHOOK_SECRET") or None
+# Сколько апдейтов обрабатывается одновременно
+WEBHOOK_MAX_CONCURRENCY: int = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "50"))
+
+# FSM-хранилище и блокировки: memory (один процесс), sqlite (общий файл БД) или redis.
+# Для redis нужен пакет redis>=5 (в requirements.txt он закомментирован как необязательный)
+FSM_STORAGE: str = os.getenv("FSM_STORAGE", "sqlite")
+REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Кэш чтения FSM в процессе: максимум ключей и время жизни, секунды
+FSM_CACHE_SIZE: int = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL: float = float(os.getenv("FSM_CACHE_TTL", "30"))
+
+# Многопроцессный режим (workers.py): число воркеров, апдейтов в обработке
+# на воркер и длина очереди апдейтов к каждому воркеру
+BOT_WORKERS: int = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 2)))
+WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", "50"))
+WORKER_QUEUE_SIZE: int = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+
+# Как часто перечитывать профиль бота (get_me), секунды
+BOT_INFO_REFRESH: float = float(os.getenv("BOT_INFO_REFRESH", "3600"))
+
+# Сколько клавиатур с параметрами держать готовыми (LRU)
+KEYBOARD_CACHE_SIZE: int = int(os.getenv("KEYBOARD_CACHE_SIZE", "1024"))
+
+# Ответ на pre_checkout медленнее этого порога (мс) пишется в лог
+# (Telegram ждет ответа не дольше 10 секунд)
+PRE_CHECKOUT_SLOW_MS: float = float(os.getenv("PRE_CHECKOUT_SLOW_MS", "500"))
+
+# Через сколько секунд после броска показать результат (пока крутится анимация)
+# и сколько отложенных отправок выполнять одновременно
+DICE_REVEAL_DELAY: float = float(os.getenv("DICE_REVEAL_DELAY", "2"))
+DELAYED_SEND_CONCURRENCY: int = int(os.getenv("DELAYED_SEND_CONCURRENCY", "20"))
 
 # Валидация критичных параметров
 if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
@@ -18,4 +109,23 @@ if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
 if ADMIN_ID == 0:
     raise ValueError("❌ ADMIN_ID не установлен! Установите переменную окружения ADMIN_ID")
 
-__all__ = ['BOT_TOKEN', 'ADMIN_CHANNEL_ID', 'ADMIN_ID', 'MIN_REFERRALS', 'MIN_STARS_WITHDRAW']
+if FSM_STORAGE not in ("memory", "sqlite", "redis"):
+    raise ValueError(f"❌ Неизвестный FSM_STORAGE: {FSM_STORAGE} (ожидается memory, sqlite или redis)")
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"❌ Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+
+__all__ = ['BOT_TOKEN', 'ADMIN_CHANNEL_ID', 'ADMIN_ID', 'MIN_REFERRALS', 'MIN_STARS_WITHDRAW',
+           'MAX_PENDING_WITHDRAWALS',
+           'DB_POOL_READERS', 'DB_PROFILE', 'DB_JOURNAL_MODE', 'DB_SYNCHRONOUS',
+           'DB_CACHE_SIZE', 'DB_MMAP_SIZE', 'DB_TEMP_STORE', 'DB_BUSY_TIMEOUT',
+           'DB_MAINTENANCE_INTERVAL', 'DB_BATCH_INTERVAL_MS', 'DB_BATCH_MAX_OPS',
+           'USER_CACHE_SIZE', 'USER_CACHE_TTL', 'LEADERBOARD_SIZE', 'LEADERBOARD_REFRESH',
+           'STATS_CACHE_TTL', 'BROADCAST_RATE', 'BROADCAST_CONCURRENCY',
+           'BROADCAST_PER_CHAT_INTERVAL', 'BROADCAST_MAX_RETRIES', 'BROADCAST_CHUNK_SIZE',
+           'TELEGRAM_API_URL', 'BOT_MODE', 'WEBHOOK_HOST', 'WEBHOOK_PORT', 'WEBHOOK_PATH',
+           'WEBHOOK_URL', 'WEBHOOK_SECRET', 'WEBHOOK_MAX_CONCURRENCY',
+           'FSM_STORAGE', 'REDIS_URL', 'FSM_CACHE_SIZE', 'FSM_CACHE_TTL',
+           'BOT_WORKERS', 'WORKER_CONCURRENCY', 'WORKER_QUEUE_SIZE', 'BOT_INFO_REFRESH',
+           'KEYBOARD_CACHE_SIZE', 'PRE_CHECKOUT_SLOW_MS', 'DICE_REVEAL_DELAY',
+           'DELAYED_SEND_CONCURRENCY']
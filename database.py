@@ -1,15 +1,467 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import aiosqlite
 import logging
-from typing import Optional, List, Tuple
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, List, Tuple, Dict, AsyncIterator, Iterable, Any, Callable, Awaitable
+
+from config import (
+    DB_POOL_READERS, DB_PROFILE, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE,
+    DB_MMAP_SIZE, DB_TEMP_STORE, DB_BUSY_TIMEOUT, DB_MAINTENANCE_INTERVAL,
+    DB_BATCH_INTERVAL_MS, DB_BATCH_MAX_OPS, USER_CACHE_SIZE, USER_CACHE_TTL, STATS_CACHE_TTL,
+    BROADCAST_CHUNK_SIZE
+)
 
 DB_PATH = "bot_database.db"
 logger = logging.getLogger(__name__)
 
-async def init_db():
-    """Создание всех таблиц SQLite с индексами"""
+# === ПРОФИЛИ ХРАНИЛИЩА ===
+# cache_size < 0 — размер в КиБ, mmap_size в байтах, busy_timeout в мс
+STORAGE_PROFILES = {
+    "safe": {
+        "journal_mode": "WAL", "synchronous": "FULL", "cache_size": -8000,
+        "mmap_size": 0, "temp_store": "DEFAULT", "busy_timeout": 10000,
+    },
+    "balanced": {
+        "journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -32000,
+        "mmap_size": 128 * 1024 * 1024, "temp_store": "MEMORY", "busy_timeout": 5000,
+    },
+    "fast": {
+        "journal_mode": "WAL", "synchronous": "OFF", "cache_size": -64000,
+        "mmap_size": 512 * 1024 * 1024, "temp_store": "MEMORY", "busy_timeout": 5000,
+    },
+}
+
+def load_storage_profile() -> Tuple[str, dict]:
+    """Профиль из config.DB_PROFILE с переопределениями из переменных окружения"""
+    name = DB_PROFILE if DB_PROFILE in STORAGE_PROFILES else "balanced"
+    if name != DB_PROFILE:
+        logger.warning(f"Неизвестный профиль БД '{DB_PROFILE}', используется '{name}'")
+    
+    profile = dict(STORAGE_PROFILES[name])
+    overrides = {
+        "journal_mode": DB_JOURNAL_MODE,
+        "synchronous": DB_SYNCHRONOUS,
+        "cache_size": DB_CACHE_SIZE,
+        "mmap_size": DB_MMAP_SIZE,
+        "temp_store": DB_TEMP_STORE,
+        "busy_timeout": DB_BUSY_TIMEOUT,
+    }
+    profile.update({key: value for key, value in overrides.items() if value is not None})
+    return name, profile
+
+# === ПУЛ СОЕДИНЕНИЙ ===
+class ConnectionPool:
+    """
+    Постоянные соединения с БД: несколько читателей и один писатель.
+    Писатель сериализован через asyncio.Lock, так что SQLite не дерется
+    за блокировку файла внутри процесса.
+    """
+
+    def __init__(self, path: str, readers: int = 4, pragmas: Optional[dict] = None):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.pragmas = pragmas or {}
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._maintenance_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, primary: bool = False) -> aiosqlite.Connection:
+        # isolation_level=None: транзакциями управляем явно (см. transaction())
+        db = await aiosqlite.connect(self.path, isolation_level=None)
+        try:
+            await self._apply_pragmas(db, primary)
+        except BaseException:
+            await db.close()
+            raise
+        return db
+
+    async def _apply_pragmas(self, db: aiosqlite.Connection, primary: bool):
+        # busy_timeout первым, чтобы остальные PRAGMA ждали блокировку, а не падали
+        if "busy_timeout" in self.pragmas:
+            await db.execute(f"PRAGMA busy_timeout = {int(self.pragmas['busy_timeout'])}")
+        # journal_mode хранится в самом файле БД — достаточно выставить один раз
+        if primary and "journal_mode" in self.pragmas:
+            async with db.execute(f"PRAGMA journal_mode = {self.pragmas['journal_mode']}") as cursor:
+                mode = (await cursor.fetchone())[0]
+            if mode.upper() != str(self.pragmas["journal_mode"]).upper():
+                logger.warning(f"SQLite не включил journal_mode={self.pragmas['journal_mode']}, текущий: {mode}")
+        for key in ("synchronous", "temp_store"):
+            if key in self.pragmas:
+                await db.execute(f"PRAGMA {key} = {self.pragmas[key]}")
+        for key in ("cache_size", "mmap_size"):
+            if key in self.pragmas:
+                await db.execute(f"PRAGMA {key} = {int(self.pragmas[key])}")
+
+    async def open(self):
+        """Открыть соединения (повторный вызов ничего не делает)"""
+        if self.is_open:
+            return
+        self._writer = await self._connect(primary=True)
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect()
+            self._reader_conns.append(conn)
+            self._readers.put_nowait(conn)
+        logger.info(f"Пул БД открыт: {self.readers_count} читателей + 1 писатель")
+
+    def start_maintenance(self, interval: float):
+        """Фоновые PRAGMA optimize и wal_checkpoint(TRUNCATE) раз в interval секунд"""
+        if interval <= 0 or self._maintenance_task is not None:
+            return
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop(interval))
+
+    async def _maintenance_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.maintenance()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания БД: {e}")
+
+    async def maintenance(self):
+        """Обновить статистику планировщика и усечь WAL-файл"""
+        async with self.writer() as db:
+            await db.execute("PRAGMA optimize")
+            async with db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+                busy, log_pages, checkpointed = await cursor.fetchone()
+        if busy:
+            logger.info(f"Чекпоинт WAL отложен: заняты читатели ({checkpointed}/{log_pages} страниц)")
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        if not self.is_open:
+            return
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        async with self._write_lock:
+            try:
+                await self._writer.execute("PRAGMA optimize")
+            except Exception as e:
+                logger.error(f"Ошибка PRAGMA optimize при закрытии: {e}")
+            for conn in self._reader_conns:
+                await conn.close()
+            await self._writer.close()
+            self._reader_conns = []
+            self._readers = None
+            self._writer = None
+        logger.info("Пул БД закрыт")
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Взять соединение-читатель на время блока"""
+        if not self.is_open:
+            raise RuntimeError("Пул БД не открыт, вызовите init_db()")
+        readers = self._readers
+        db = await readers.get()
+        try:
+            yield db
+        finally:
+            readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Эксклюзивный доступ к соединению-писателю (без транзакции)"""
+        if not self.is_open:
+            raise RuntimeError("Пул БД не открыт, вызовите init_db()")
+        async with self._write_lock:
+            yield self._writer
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Писатель внутри BEGIN IMMEDIATE: COMMIT при успехе, ROLLBACK при ошибке"""
+        async with self.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                await db.rollback()
+                raise
+            else:
+                await db.commit()
+
+    async def fetchone(self, sql: str, params: Iterable[Any] = ()) -> Optional[Tuple]:
+        async with self.reader() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, params: Iterable[Any] = ()) -> List[Tuple]:
+        async with self.reader() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+# === ГРУППОВАЯ ЗАПИСЬ ===
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+class WriteBatcher:
+    """
+    Склеивает мелкие записи (рефералы, попытки) в одну транзакцию: сброс
+    раз в interval_ms или как только накопилось max_ops операций.
+    Каждая операция выполняется в своем SAVEPOINT — ошибка одной не
+    откатывает соседей. Результат приходит через Future после COMMIT.
+    """
+
+    def __init__(self, pool: ConnectionPool, interval_ms: int = 20, max_ops: int = 100):
+        self.pool = pool
+        self.interval = max(0, interval_ms) / 1000
+        self.max_ops = max(1, max_ops)
+        self._queue: List[Tuple[WriteOp, asyncio.Future]] = []
+        self._has_ops = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать всё, что в очереди, и остановить фоновую задачу"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._has_ops.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def submit(self, op: WriteOp) -> asyncio.Future:
+        """Поставить операцию op(db) в очередь; Future вернет ее результат"""
+        if self._task is None or self._stopping:
+            raise RuntimeError("Групповая запись не запущена, вызовите init_db()")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((op, future))
+        self._has_ops.set()
+        if len(self._queue) >= self.max_ops:
+            self._full.set()
+        return future
+
+    async def _run(self):
+        while True:
+            await self._has_ops.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._stopping and not self._queue:
+                return
+
+    async def _flush(self):
+        batch = self._queue[:self.max_ops]
+        self._queue = self._queue[self.max_ops:]
+        if len(self._queue) < self.max_ops and not self._stopping:
+            self._full.clear()
+        if not self._queue and not self._stopping:
+            self._has_ops.clear()
+        if not batch:
+            return
+        
+        results = []
+        try:
+            async with self.pool.transaction() as db:
+                for op, _ in batch:
+                    await db.execute("SAVEPOINT batch_op")
+                    try:
+                        value = await op(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO batch_op")
+                        await db.execute("RELEASE batch_op")
+                        results.append((False, e))
+                    else:
+                        await db.execute("RELEASE batch_op")
+                        results.append((True, value))
+        except Exception as e:
+            logger.error(f"Ошибка групповой записи ({len(batch)} операций): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+# === КЭШ ПОЛЬЗОВАТЕЛЕЙ ===
+# Индексы колонок в строке users (SELECT *)
+USER_REFERRALS_COL = 4
+USER_STARS_COL = 5
+USER_UNREACHABLE_COL = 7
+
+class UserCache:
+    """
+    LRU-кэш строк users с TTL. Мутирующие функции обновляют или сбрасывают
+    запись; счетчик поколений не дает чтению, начатому до записи,
+    положить в кэш устаревшую строку.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rows: "OrderedDict[int, Tuple[float, Tuple]]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id: int) -> Optional[Tuple]:
+        entry = self._rows.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, row = entry
+        if expires_at < time.monotonic():
+            del self._rows[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._rows.move_to_end(user_id)
+        self.hits += 1
+        return row
+
+    def put(self, user_id: int, row: Tuple, generation: Optional[int] = None):
+        """Положить строку; если с начала чтения была запись — пропустить"""
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._rows[user_id] = (time.monotonic() + self.ttl, row)
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.maxsize:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, user_id: int, **columns: Any):
+        """Записать новые значения колонок в закэшированную строку (write-through)"""
+        self.generation += 1
+        entry = self._rows.get(user_id)
+        if entry is None:
+            return
+        expires_at, row = entry
+        row = list(row)
+        if "referrals_count" in columns:
+            row[USER_REFERRALS_COL] = columns["referrals_count"]
+        if "stars_earned" in columns:
+            row[USER_STARS_COL] = columns["stars_earned"]
+        self._rows[user_id] = (expires_at, tuple(row))
+
+    def invalidate(self, user_id: int):
+        self.generation += 1
+        self._rows.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._rows.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# === СНИМОК АКТИВНОГО РОЗЫГРЫША ===
+class GiveawaySnapshot:
+    """
+    Активный розыгрыш в памяти: чтение ничего не стоит. Обновляется при
+    каждой смене активного розыгрыша (создание, победа, остановка) и по
+    событиям синхронизации от других процессов.
+    """
+
+    def __init__(self):
+        self.row: Optional[Tuple] = None
+        self.loaded = False
+
+    def set(self, row: Optional[Tuple]):
+        self.row = row
+        self.loaded = True
+
+STORAGE_PROFILE_NAME, STORAGE_PROFILE = load_storage_profile()
+pool = ConnectionPool(DB_PATH, DB_POOL_READERS, STORAGE_PROFILE)
+batcher = WriteBatcher(pool, DB_BATCH_INTERVAL_MS, DB_BATCH_MAX_OPS)
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# Подписчики на изменение числа рефералов: callback(user_id, referrals_count).
+# Новый пользователь приходит с referrals_count = 0; события других процессов тоже.
+referral_listeners: List[Callable[[int, int], None]] = []
+# Новые задания рассылки из других процессов: await callback(job_id)
+broadcast_listeners: List[Callable[[int], Awaitable[None]]] = []
+# Зеркало таблицы giveaway_stats: giveaway_id -> счетчики
+giveaway_counters: Dict[int, dict] = {}
+active_giveaway = GiveawaySnapshot()
+# Подписчики на локальные изменения кэшей в памяти: callback(event, payload).
+# В режиме нескольких процессов (workers.py) события рассылаются остальным.
+sync_listeners: List[Callable[[str, Any], None]] = []
+
+def _publish(event: str, payload: Any = None):
+    for listener in sync_listeners:
+        listener(event, payload)
+
+def _forget_user(user_id: int):
+    """Сбросить строку пользователя в кэше (здесь и в других процессах)"""
+    user_cache.invalidate(user_id)
+    _publish("user", user_id)
+
+def _notify_referrals(user_id: int, referrals_count: int):
+    for listener in referral_listeners:
+        listener(user_id, referrals_count)
+    _publish("referrals", (user_id, referrals_count))
+
+async def apply_sync_event(event: str, payload: Any = None):
+    """Применить изменение, сделанное другим процессом (без повторной публикации)"""
+    if event == "user":
+        user_cache.invalidate(payload)
+    elif event == "referrals":
+        user_id, referrals_count = payload
+        if referrals_count:
+            user_cache.invalidate(user_id)
+        for listener in referral_listeners:
+            listener(user_id, referrals_count)
+    elif event == "giveaway":
+        await refresh_active_giveaway()
+    elif event == "broadcast":
+        for listener in broadcast_listeners:
+            await listener(payload)
+    elif event == "counters":
+        giveaway_id, deltas = payload
+        _apply_giveaway_counters(giveaway_id, deltas)
+    else:
+        logger.warning(f"Неизвестное событие синхронизации: {event}")
+
+async def init_db(maintenance: bool = True):
+    """
+    Открытие пула и создание всех таблиц SQLite с индексами.
+    maintenance=False — без фонового обслуживания (его ведет другой процесс).
+    """
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        await pool.open()
+        logger.info(
+            f"Профиль БД '{STORAGE_PROFILE_NAME}': "
+            + ", ".join(f"{key}={value}" for key, value in pool.pragmas.items())
+        )
+        async with pool.transaction() as db:
             # Существующая таблица пользователей
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -20,10 +472,17 @@ async def init_db():
                     referrals_count INTEGER DEFAULT 0,
                     stars_earned INTEGER DEFAULT 0,
                     joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    unreachable TEXT,
                     FOREIGN KEY(invited_by) REFERENCES users(user_id)
                 )
             """)
             
+            # Миграция: причина недоступности (blocked / deactivated / chat_not_found), NULL — доступен
+            async with db.execute("PRAGMA table_info(users)") as cursor:
+                user_columns = {row[1] for row in await cursor.fetchall()}
+            if "unreachable" not in user_columns:
+                await db.execute("ALTER TABLE users ADD COLUMN unreachable TEXT")
+            
             # Таблица заявок на вывод
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS withdrawal_requests (
@@ -67,6 +526,102 @@ async def init_db():
                 )
             """)
             
+            # === Счетчики розыгрышей (поддерживаются в add_attempt / update_attempt_result) ===
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS giveaway_stats (
+                    giveaway_id INTEGER PRIMARY KEY,
+                    total_attempts INTEGER NOT NULL DEFAULT 0,
+                    unique_users INTEGER NOT NULL DEFAULT 0,
+                    wins INTEGER NOT NULL DEFAULT 0,
+                    stars_collected INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(giveaway_id) REFERENCES nft_giveaways(id)
+                )
+            """)
+            
+            # === Сводные счетчики админки (одна строка, ведется триггерами ниже) ===
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS bot_stats (
+                    id INTEGER PRIMARY KEY CHECK(id = 1),
+                    total_users INTEGER NOT NULL DEFAULT 0,
+                    total_referrals INTEGER NOT NULL DEFAULT 0,
+                    unreachable_users INTEGER NOT NULL DEFAULT 0,
+                    total_withdrawals INTEGER NOT NULL DEFAULT 0,
+                    pending_count INTEGER NOT NULL DEFAULT 0,
+                    paid_count INTEGER NOT NULL DEFAULT 0,
+                    total_paid INTEGER NOT NULL DEFAULT 0,
+                    pending_amount INTEGER NOT NULL DEFAULT 0,
+                    total_payments INTEGER NOT NULL DEFAULT 0,
+                    revenue_total INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            
+            # === Платежи Stars: одна запись на telegram_payment_charge_id ===
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    charge_id TEXT NOT NULL,
+                    provider_charge_id TEXT,
+                    user_id INTEGER NOT NULL,
+                    giveaway_id INTEGER,
+                    attempt_id INTEGER,
+                    amount INTEGER NOT NULL,
+                    currency TEXT NOT NULL,
+                    payload TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id),
+                    FOREIGN KEY(giveaway_id) REFERENCES nft_giveaways(id),
+                    FOREIGN KEY(attempt_id) REFERENCES nft_attempts(id)
+                )
+            """)
+            
+            # === Рассылки: задания и доставки (для возобновления после рестарта) ===
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    exclude_user INTEGER,
+                    status TEXT DEFAULT 'running' CHECK(status IN ('running', 'done', 'cancelled')),
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    last_user_id INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            
+            # last_user_id в задании — чекпоинт: все user_id <= него уже отработаны;
+            # здесь только доставки за чекпоинтом текущей страницы (и история)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    job_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL CHECK(status IN ('sent', 'failed')),
+                    PRIMARY KEY (job_id, user_id),
+                    FOREIGN KEY(job_id) REFERENCES broadcast_jobs(id)
+                ) WITHOUT ROWID
+            """)
+            
+            # FSM-состояния (общие для всех процессов бота): ключ -> состояние и JSON данных
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}'
+                ) WITHOUT ROWID
+            """)
+            
+            # Межпроцессные блокировки с истечением (анти-двойной клик)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS shared_locks (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                ) WITHOUT ROWID
+            """)
+            
             # Индексы
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_referrals ON users(referrals_count DESC)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_user ON withdrawal_requests(user_id)")
@@ -74,9 +629,39 @@ async def init_db():
             await db.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_active ON nft_giveaways(is_active)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_attempts_giveaway ON nft_attempts(giveaway_id)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_attempts_user ON nft_attempts(user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_attempts_giveaway_user ON nft_attempts(giveaway_id, user_id)")
+            # Новые за сегодня — диапазон по индексу, а не проход по всем пользователям
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_joined ON users(joined_date)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_reachable ON users(unreachable, user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)")
+            await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge ON payments(charge_id)")
+            # Покрывающие индексы для выручки по розыгрышу и по дням
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_giveaway ON payments(giveaway_id, amount, user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at, amount)")
+            
+            for trigger in BOT_STATS_TRIGGERS:
+                await db.execute(trigger)
             
-            await db.commit()
-            logger.info("База данных инициализирована успешно")
+            # Старая БД без счетчиков — заполняем их один раз из nft_attempts
+            async with db.execute(
+                "SELECT NOT EXISTS (SELECT 1 FROM giveaway_stats) AND EXISTS (SELECT 1 FROM nft_attempts)"
+            ) as cursor:
+                needs_backfill = (await cursor.fetchone())[0]
+            if needs_backfill:
+                await _rebuild_giveaway_stats(db)
+                logger.info("Счетчики розыгрышей заполнены из истории попыток")
+            async with db.execute("SELECT NOT EXISTS (SELECT 1 FROM bot_stats)") as cursor:
+                needs_bot_stats = (await cursor.fetchone())[0]
+            if needs_bot_stats:
+                await _rebuild_bot_stats(db)
+                logger.info("Сводные счетчики заполнены по таблицам")
+        
+        await load_giveaway_counters()
+        await refresh_active_giveaway()
+        if maintenance:
+            pool.start_maintenance(DB_MAINTENANCE_INTERVAL)
+        batcher.start()
+        logger.info("База данных инициализирована успешно")
     except Exception as e:
         logger.error(f"Ошибка инициализации БД: {e}")
         raise
@@ -84,107 +669,215 @@ async def init_db():
 # === Существующие функции (без изменений) ===
 async def add_user(user_id: int, username: Optional[str], full_name: str, invited_by: Optional[int] = None) -> bool:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.transaction() as db:
             cursor = await db.execute(
                 "INSERT OR IGNORE INTO users (user_id, username, full_name, invited_by) VALUES (?, ?, ?, ?)",
                 (user_id, username, full_name, invited_by)
             )
-            await db.commit()
-            return cursor.rowcount > 0
+            inserted = cursor.rowcount > 0
+        # INSERT OR IGNORE существующую строку не меняет, а отсутствующих
+        # пользователей кэш не хранит — сбрасывать нечего ни здесь, ни в других процессах
+        if inserted:
+            _notify_referrals(user_id, 0)
+        return inserted
     except Exception as e:
         logger.error(f"Ошибка добавления пользователя {user_id}: {e}")
         return False
 
 async def get_user(user_id: int) -> Optional[Tuple]:
+    row = user_cache.get(user_id)
+    if row is not None:
+        return row
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            return await cursor.fetchone()
+        generation = user_cache.generation
+        row = await pool.fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        if row is not None:
+            user_cache.put(user_id, row, generation)
+        return row
     except Exception as e:
         logger.error(f"Ошибка получения пользователя {user_id}: {e}")
         return None
 
 async def increment_referrals(user_id: int) -> bool:
+    async def op(db):
+        async with db.execute(
+            "UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ? RETURNING referrals_count",
+            (user_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return rows[0][0] if rows else None
+    
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ?", (user_id,))
-            await db.commit()
-            return True
+        referrals_count = await batcher.submit(op)
+        if referrals_count is None:
+            return False
+        user_cache.invalidate(user_id)
+        _notify_referrals(user_id, referrals_count)
+        return True
     except Exception as e:
         logger.error(f"Ошибка инкремента рефералов {user_id}: {e}")
         return False
 
 async def add_stars(user_id: int, amount: int = 1) -> bool:
+    async def op(db):
+        await db.execute("UPDATE users SET stars_earned = stars_earned + ? WHERE user_id = ?", (amount, user_id))
+    
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("UPDATE users SET stars_earned = stars_earned + ? WHERE user_id = ?", (amount, user_id))
-            await db.commit()
-            return True
+        await batcher.submit(op)
+        _forget_user(user_id)
+        return True
     except Exception as e:
         logger.error(f"Ошибка начисления звезд {user_id}: {e}")
         return False
 
+async def credit_referral(referrer_id: int, stars: int = 1) -> Optional[int]:
+    """
+    Засчитать реферала и начислить звезды одним UPDATE ... RETURNING.
+    Возвращает новый баланс или None, если реферер не найден.
+    """
+    async def op(db):
+        async with db.execute(
+            """UPDATE users
+               SET referrals_count = referrals_count + 1, stars_earned = stars_earned + ?
+               WHERE user_id = ?
+               RETURNING referrals_count, stars_earned""",
+            (stars, referrer_id)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return rows[0] if rows else None
+    
+    try:
+        row = await batcher.submit(op)
+        if row is None:
+            return None
+        referrals_count, stars_earned = row
+        user_cache.update(referrer_id, referrals_count=referrals_count, stars_earned=stars_earned)
+        # Другие процессы по этому событию сбросят строку в кэше и сдвинут место
+        _notify_referrals(referrer_id, referrals_count)
+        return stars_earned
+    except Exception as e:
+        logger.error(f"Ошибка начисления за реферала {referrer_id}: {e}")
+        return None
+
 async def get_top_referrers(limit: int = 10) -> List[Tuple]:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT user_id, username, referrals_count, stars_earned FROM users ORDER BY referrals_count DESC LIMIT ?",
-                (limit,)
-            )
-            return await cursor.fetchall()
+        return await pool.fetchall(
+            "SELECT user_id, username, referrals_count, stars_earned FROM users ORDER BY referrals_count DESC LIMIT ?",
+            (limit,)
+        )
     except Exception as e:
         logger.error(f"Ошибка получения топа: {e}")
         return []
 
-async def create_withdrawal_request(user_id: int, amount: int) -> Optional[int]:
+async def get_referral_histogram() -> Dict[int, int]:
+    """Сколько пользователей с каждым числом рефералов (для расчета места)"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT stars_earned FROM users WHERE user_id = ?",
+        rows = await pool.fetchall(
+            "SELECT COALESCE(referrals_count, 0), COUNT(*) FROM users GROUP BY 1"
+        )
+        return dict(rows)
+    except Exception as e:
+        logger.error(f"Ошибка получения рефералов: {e}")
+        return {}
+
+# Коды результата create_withdrawal_request
+WITHDRAW_OK = "ok"
+WITHDRAW_NO_USER = "no_user"
+WITHDRAW_FEW_REFERRALS = "few_referrals"
+WITHDRAW_LOW_BALANCE = "low_balance"
+WITHDRAW_TOO_MANY_PENDING = "too_many_pending"
+WITHDRAW_ERROR = "error"
+
+async def create_withdrawal_request(
+    user_id: int, amount: int, min_referrals: int = 0, max_pending: int = 3
+) -> Tuple[str, dict]:
+    """
+    Создать заявку на вывод одной транзакцией BEGIN IMMEDIATE: проверка
+    рефералов, баланса и числа заявок в обработке одним SELECT, затем
+    списание и вставка. Возвращает (код WITHDRAW_*, данные): request_id,
+    full_name, balance (до списания), referrals, pending.
+    """
+    info = {"request_id": None, "full_name": None, "balance": 0, "referrals": 0, "pending": 0}
+    try:
+        async with pool.transaction() as db:
+            async with db.execute(
+                """SELECT full_name, stars_earned, referrals_count,
+                          (SELECT COUNT(*) FROM withdrawal_requests
+                           WHERE user_id = users.user_id AND status = 'pending')
+                   FROM users WHERE user_id = ?""",
                 (user_id,)
-            )
-            balance_row = await cursor.fetchone()
+            ) as cursor:
+                row = await cursor.fetchone()
             
-            if not balance_row or balance_row[0] < amount:
-                return None
+            if row is None:
+                return WITHDRAW_NO_USER, info
+            info.update(full_name=row[0], balance=row[1], referrals=row[2], pending=row[3])
+            if info["referrals"] < min_referrals:
+                return WITHDRAW_FEW_REFERRALS, info
+            if info["balance"] < amount:
+                return WITHDRAW_LOW_BALANCE, info
+            if info["pending"] >= max_pending:
+                return WITHDRAW_TOO_MANY_PENDING, info
             
             await db.execute(
                 "UPDATE users SET stars_earned = stars_earned - ? WHERE user_id = ?",
                 (amount, user_id)
             )
-            
             cursor = await db.execute(
                 "INSERT INTO withdrawal_requests (user_id, amount, status) VALUES (?, ?, 'pending')",
                 (user_id, amount)
             )
-            request_id = cursor.lastrowid
-            await db.commit()
-            return request_id
+            info["request_id"] = cursor.lastrowid
+        
+        _forget_user(user_id)
+        return WITHDRAW_OK, info
             
     except Exception as e:
         logger.error(f"Ошибка создания заявки {user_id}: {e}")
-        return None
+        return WITHDRAW_ERROR, info
 
-async def get_user_withdrawals(user_id: int) -> List[Tuple]:
+async def cancel_withdrawal_request(request_id: int) -> bool:
+    """Отменить заявку в обработке и вернуть звезды (одна транзакция)"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT id, amount, status, created_at FROM withdrawal_requests WHERE user_id = ? ORDER BY created_at DESC",
-                (user_id,)
+        async with pool.transaction() as db:
+            async with db.execute(
+                "SELECT user_id, amount FROM withdrawal_requests WHERE id = ? AND status = 'pending'",
+                (request_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return False
+            await db.execute(
+                "UPDATE withdrawal_requests SET status = 'rejected', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (request_id,)
+            )
+            await db.execute(
+                "UPDATE users SET stars_earned = stars_earned + ? WHERE user_id = ?",
+                (row[1], row[0])
             )
-            return await cursor.fetchall()
+        _forget_user(row[0])
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка отмены заявки {request_id}: {e}")
+        return False
+
+async def get_user_withdrawals(user_id: int) -> List[Tuple]:
+    try:
+        return await pool.fetchall(
+            "SELECT id, amount, status, created_at FROM withdrawal_requests WHERE user_id = ? ORDER BY created_at DESC",
+            (user_id,)
+        )
     except Exception as e:
         logger.error(f"Ошибка получения заявок {user_id}: {e}")
         return []
 
 async def update_withdrawal_status(request_id: int, new_status: str) -> bool:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.transaction() as db:
             await db.execute(
                 "UPDATE withdrawal_requests SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
                 (new_status, request_id)
             )
-            await db.commit()
             return True
     except Exception as e:
         logger.error(f"Ошибка обновления статуса {request_id}: {e}")
@@ -192,42 +885,77 @@ async def update_withdrawal_status(request_id: int, new_status: str) -> bool:
 
 async def get_withdrawal_request(request_id: int) -> Optional[Tuple]:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT * FROM withdrawal_requests WHERE id = ?", (request_id,))
-            return await cursor.fetchone()
+        return await pool.fetchone("SELECT * FROM withdrawal_requests WHERE id = ?", (request_id,))
     except Exception as e:
         logger.error(f"Ошибка получения деталей заявки {request_id}: {e}")
         return None
 
 async def get_pending_withdrawals_count(user_id: int) -> int:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM withdrawal_requests WHERE user_id = ? AND status = 'pending'",
-                (user_id,)
-            )
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        result = await pool.fetchone(
+            "SELECT COUNT(*) FROM withdrawal_requests WHERE user_id = ? AND status = 'pending'",
+            (user_id,)
+        )
+        return result[0] if result else 0
     except Exception as e:
         logger.error(f"Ошибка: {e}")
         return 0
 
 # === НОВЫЕ ФУНКЦИИ ДЛЯ NFT (ИСПРАВЛЕННЫЕ) ===
-async def get_all_users() -> List[int]:
-    """Получить всех пользователей для рассылки"""
+async def iter_user_id_chunks(chunk_size: int = BROADCAST_CHUNK_SIZE, after: int = 0) -> AsyncIterator[List[int]]:
+    """
+    Постранично выдать user_id доступных пользователей по возрастанию
+    (keyset: user_id > последнего). В памяти не больше одной страницы.
+    """
+    last_id = after
+    while True:
+        rows = await pool.fetchall(
+            "SELECT user_id FROM users WHERE unreachable IS NULL AND user_id > ? ORDER BY user_id LIMIT ?",
+            (last_id, chunk_size)
+        )
+        if not rows:
+            return
+        chunk = [row[0] for row in rows]
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]
+
+async def iter_user_ids(chunk_size: int = BROADCAST_CHUNK_SIZE, after: int = 0) -> AsyncIterator[int]:
+    """Получатели рассылки потоком, без загрузки всех id в память"""
+    async for chunk in iter_user_id_chunks(chunk_size, after):
+        for user_id in chunk:
+            yield user_id
+
+async def reactivate_user(user_id: int) -> bool:
+    """Снять пометку «недоступен» (пользователь снова написал боту)"""
+    user = await get_user(user_id)
+    if user is None or user[USER_UNREACHABLE_COL] is None:
+        return False
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT user_id FROM users")
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+        async with pool.transaction() as db:
+            await db.execute("UPDATE users SET unreachable = NULL WHERE user_id = ?", (user_id,))
+        _forget_user(user_id)
+        return True
     except Exception as e:
-        logger.error(f"Ошибка получения всех пользователей: {e}")
-        return []
+        logger.error(f"Ошибка реактивации пользователя {user_id}: {e}")
+        return False
+
+async def count_users(reachable_only: bool = False) -> int:
+    try:
+        if reachable_only:
+            row = await pool.fetchone("SELECT COUNT(*) FROM users WHERE unreachable IS NULL")
+        else:
+            row = await pool.fetchone("SELECT COUNT(*) FROM users")
+        return row[0] if row else 0
+    except Exception as e:
+        logger.error(f"Ошибка подсчета пользователей: {e}")
+        return 0
 
 async def create_giveaway(bet_amount: int, nft_link: str, created_by: int) -> Optional[int]:
     """Создание нового розыгрыша (закрывает предыдущий активный)"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.transaction() as db:
             # Закрываем предыдущий активный розыгрыш
             await db.execute(
                 "UPDATE nft_giveaways SET is_active = 0 WHERE is_active = 1"
@@ -237,87 +965,582 @@ async def create_giveaway(bet_amount: int, nft_link: str, created_by: int) -> Op
                 "INSERT INTO nft_giveaways (bet_amount, nft_link, created_by) VALUES (?, ?, ?)",
                 (bet_amount, nft_link, created_by)
             )
-            await db.commit()
-            return cursor.lastrowid
+            giveaway_id = cursor.lastrowid
+            async with db.execute("SELECT * FROM nft_giveaways WHERE id = ?", (giveaway_id,)) as cursor:
+                row = await cursor.fetchone()
+        
+        active_giveaway.set(row)
+        giveaway_counters.setdefault(giveaway_id, _empty_giveaway_counters())
+        _publish("giveaway")
+        return giveaway_id
     except Exception as e:
         logger.error(f"Ошибка создания розыгрыша: {e}")
         return None
 
-async def get_active_giveaway() -> Optional[Tuple]:
-    """Получить активный розыгрыш"""
+async def refresh_active_giveaway() -> Optional[Tuple]:
+    """Перечитать активный розыгрыш из БД в снимок"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT * FROM nft_giveaways WHERE is_active = 1 ORDER BY created_at DESC LIMIT 1"
-            )
-            return await cursor.fetchone()
+        row = await pool.fetchone(
+            "SELECT * FROM nft_giveaways WHERE is_active = 1 ORDER BY created_at DESC LIMIT 1"
+        )
+        active_giveaway.set(row)
+        return row
     except Exception as e:
         logger.error(f"Ошибка получения активного розыгрыша: {e}")
         return None
 
-async def add_attempt(giveaway_id: int, user_id: int) -> Optional[int]:
-    """Добавить новую попытку (всегда создает новую запись)"""
+async def get_active_giveaway() -> Optional[Tuple]:
+    """Получить активный розыгрыш (из снимка в памяти)"""
+    if active_giveaway.loaded:
+        return active_giveaway.row
+    return await refresh_active_giveaway()
+
+async def _insert_attempt(db: aiosqlite.Connection, giveaway_id: int, user_id: int, stars: int) -> Tuple[int, bool]:
+    """Вставить попытку и обновить giveaway_stats; (id попытки, первый ли это бросок игрока)"""
+    async with db.execute(
+        "SELECT 1 FROM nft_attempts WHERE giveaway_id = ? AND user_id = ? LIMIT 1",
+        (giveaway_id, user_id)
+    ) as cursor:
+        is_new_player = await cursor.fetchone() is None
+    cursor = await db.execute(
+        "INSERT INTO nft_attempts (giveaway_id, user_id) VALUES (?, ?)",
+        (giveaway_id, user_id)
+    )
+    await db.execute(
+        """INSERT INTO giveaway_stats (giveaway_id, total_attempts, unique_users, stars_collected)
+           VALUES (?, 1, ?, ?)
+           ON CONFLICT(giveaway_id) DO UPDATE SET
+               total_attempts = total_attempts + 1,
+               unique_users = unique_users + excluded.unique_users,
+               stars_collected = stars_collected + excluded.stars_collected""",
+        (giveaway_id, int(is_new_player), stars)
+    )
+    return cursor.lastrowid, is_new_player
+
+async def add_attempt(giveaway_id: int, user_id: int, stars: int = 0) -> Optional[int]:
+    """Добавить новую попытку (всегда создает новую запись) и обновить счетчики"""
+    async def op(db):
+        return await _insert_attempt(db, giveaway_id, user_id, stars)
+    
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "INSERT INTO nft_attempts (giveaway_id, user_id) VALUES (?, ?)",
-                (giveaway_id, user_id)
-            )
-            await db.commit()
-            return cursor.lastrowid
+        attempt_id, is_new_player = await batcher.submit(op)
+        _bump_giveaway_counters(
+            giveaway_id, total_attempts=1, unique_users=int(is_new_player), stars_collected=stars
+        )
+        return attempt_id
     except Exception as e:
         logger.error(f"Ошибка добавления попытки: {e}")
         return None
 
-async def update_attempt_result(attempt_id: int, result: str, slot_result: str) -> bool:
-    """Обновить результат попытки"""
+# === ПЛАТЕЖИ ===
+async def record_payment(
+    charge_id: str,
+    provider_charge_id: Optional[str],
+    user_id: int,
+    amount: int,
+    currency: str,
+    payload: str,
+    giveaway_id: Optional[int] = None,
+    create_attempt: bool = True,
+) -> Tuple[Optional[int], bool]:
+    """
+    Записать платеж по telegram_payment_charge_id (INSERT OR IGNORE по
+    уникальному индексу) и в той же транзакции создать попытку розыгрыша.
+    Возвращает (id попытки, новый ли платеж). Повторная доставка того же
+    апдейта попытку не создает и возвращает уже привязанную.
+    """
+    async def op(db):
+        cursor = await db.execute(
+            """INSERT OR IGNORE INTO payments
+               (charge_id, provider_charge_id, user_id, giveaway_id, amount, currency, payload)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (charge_id, provider_charge_id, user_id, giveaway_id, amount, currency, payload)
+        )
+        if cursor.rowcount == 0:
+            async with db.execute(
+                "SELECT attempt_id FROM payments WHERE charge_id = ?", (charge_id,)
+            ) as existing:
+                row = await existing.fetchone()
+            return row[0], False, False
+        if giveaway_id is None or not create_attempt:
+            return None, True, False
+        attempt_id, is_new_player = await _insert_attempt(db, giveaway_id, user_id, amount)
+        await db.execute("UPDATE payments SET attempt_id = ? WHERE id = ?", (attempt_id, cursor.lastrowid))
+        return attempt_id, True, is_new_player
+    
+    attempt_id, created, is_new_player = await batcher.submit(op)
+    if created and attempt_id is not None:
+        _bump_giveaway_counters(
+            giveaway_id, total_attempts=1, unique_users=int(is_new_player), stars_collected=amount
+        )
+    return attempt_id, created
+
+async def get_giveaway_revenue(giveaway_id: int) -> dict:
+    """Выручка розыгрыша по платежам: число платежей, плательщиков и сумма"""
+    try:
+        row = await pool.fetchone(
+            """SELECT COUNT(*), COUNT(DISTINCT user_id), COALESCE(SUM(amount), 0)
+               FROM payments WHERE giveaway_id = ?""",
+            (giveaway_id,)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения выручки розыгрыша {giveaway_id}: {e}")
+        row = (0, 0, 0)
+    return dict(zip(("payments", "payers", "amount"), row))
+
+async def get_revenue_by_giveaway(limit: int = 10) -> List[Tuple]:
+    """(giveaway_id, платежей, сумма) по последним розыгрышам с платежами"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        return await pool.fetchall(
+            """SELECT giveaway_id, COUNT(*), SUM(amount) FROM payments
+               WHERE giveaway_id IS NOT NULL
+               GROUP BY giveaway_id ORDER BY giveaway_id DESC LIMIT ?""",
+            (limit,)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения выручки по розыгрышам: {e}")
+        return []
+
+async def get_daily_revenue(days: int = 7) -> List[Tuple]:
+    """(день, платежей, сумма) за последние days дней, новые сверху"""
+    try:
+        return await pool.fetchall(
+            """SELECT date(created_at) AS day, COUNT(*), SUM(amount) FROM payments
+               WHERE created_at >= date('now', ?)
+               GROUP BY day ORDER BY day DESC""",
+            (f"-{max(days, 1) - 1} days",)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения выручки по дням: {e}")
+        return []
+
+async def update_attempt_result(attempt_id: int, result: str, slot_result: str) -> bool:
+    """Обновить результат попытки (и счетчик побед розыгрыша)"""
+    async def op(db):
+        async with db.execute(
+            "SELECT giveaway_id, result FROM nft_attempts WHERE id = ?", (attempt_id,)
+        ) as cursor:
+            previous = await cursor.fetchone()
+        await db.execute(
+            "UPDATE nft_attempts SET result = ?, slot_result = ? WHERE id = ?",
+            (result, slot_result, attempt_id)
+        )
+        if previous is None:
+            return None, 0
+        wins_delta = int(result == "win") - int(previous[1] == "win")
+        if wins_delta:
             await db.execute(
-                "UPDATE nft_attempts SET result = ?, slot_result = ? WHERE id = ?",
-                (result, slot_result, attempt_id)
+                "UPDATE giveaway_stats SET wins = wins + ? WHERE giveaway_id = ?",
+                (wins_delta, previous[0])
             )
-            await db.commit()
-            return True
+        return previous[0], wins_delta
+    
+    try:
+        giveaway_id, wins_delta = await batcher.submit(op)
+        if wins_delta:
+            _bump_giveaway_counters(giveaway_id, wins=wins_delta)
+        return True
     except Exception as e:
         logger.error(f"Ошибка обновления результата: {e}")
         return False
 
-async def close_giveaway(giveaway_id: int, winner_id: int) -> bool:
-    """Закрыть розыгрыш с победителем"""
+async def claim_win(giveaway_id: int, user_id: int) -> bool:
+    """
+    Забрать победу в розыгрыше: один условный UPDATE (compare-and-set).
+    True — победитель этот пользователь; False — розыгрыш уже выигран
+    или остановлен (или ошибка БД).
+    """
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
+        async with pool.transaction() as db:
+            cursor = await db.execute(
                 """UPDATE nft_giveaways 
                    SET is_active = 0, winner_id = ?, ended_at = CURRENT_TIMESTAMP 
-                   WHERE id = ?""",
-                (winner_id, giveaway_id)
+                   WHERE id = ? AND is_active = 1 AND winner_id IS NULL""",
+                (user_id, giveaway_id)
             )
-            await db.commit()
-            return True
+            won = cursor.rowcount == 1
     except Exception as e:
         logger.error(f"Ошибка закрытия розыгрыша: {e}")
         return False
+    if won:
+        _drop_active_giveaway(giveaway_id)
+    return won
 
-async def get_giveaway_stats(giveaway_id: int) -> dict:
-    """Получить статистику розыгрыша"""
+async def stop_giveaway(giveaway_id: int) -> bool:
+    """Завершить розыгрыш без победителя (остановка админом)"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Общее количество попыток
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM nft_attempts WHERE giveaway_id = ?",
+        async with pool.transaction() as db:
+            await db.execute(
+                "UPDATE nft_giveaways SET is_active = 0, ended_at = CURRENT_TIMESTAMP WHERE id = ?",
                 (giveaway_id,)
             )
-            total = (await cursor.fetchone())[0]
-            
-            # Количество уникальных участников
+        _drop_active_giveaway(giveaway_id)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка остановки розыгрыша {giveaway_id}: {e}")
+        return False
+
+def _drop_active_giveaway(giveaway_id: int):
+    if active_giveaway.row is not None and active_giveaway.row[0] == giveaway_id:
+        active_giveaway.set(None)
+    _publish("giveaway")
+
+# === СЧЕТЧИКИ РОЗЫГРЫШЕЙ ===
+GIVEAWAY_COUNTER_FIELDS = ("total_attempts", "unique_users", "wins", "stars_collected")
+
+def _empty_giveaway_counters() -> dict:
+    return dict.fromkeys(GIVEAWAY_COUNTER_FIELDS, 0)
+
+def _apply_giveaway_counters(giveaway_id: int, deltas: Dict[str, int]):
+    counters = giveaway_counters.setdefault(giveaway_id, _empty_giveaway_counters())
+    for key, delta in deltas.items():
+        counters[key] += delta
+
+def _bump_giveaway_counters(giveaway_id: int, **deltas: int):
+    _apply_giveaway_counters(giveaway_id, deltas)
+    _publish("counters", (giveaway_id, deltas))
+
+async def load_giveaway_counters():
+    """Загрузить зеркало счетчиков из giveaway_stats"""
+    rows = await pool.fetchall(
+        "SELECT giveaway_id, total_attempts, unique_users, wins, stars_collected FROM giveaway_stats"
+    )
+    giveaway_counters.clear()
+    for giveaway_id, *values in rows:
+        giveaway_counters[giveaway_id] = dict(zip(GIVEAWAY_COUNTER_FIELDS, values))
+
+async def _rebuild_giveaway_stats(db: aiosqlite.Connection):
+    # Каждая попытка оплачивалась ставкой розыгрыша
+    await db.execute("DELETE FROM giveaway_stats")
+    await db.execute("""
+        INSERT INTO giveaway_stats (giveaway_id, total_attempts, unique_users, wins, stars_collected)
+        SELECT a.giveaway_id, COUNT(*), COUNT(DISTINCT a.user_id),
+               COALESCE(SUM(a.result = 'win'), 0), COUNT(*) * g.bet_amount
+        FROM nft_attempts a
+        JOIN nft_giveaways g ON g.id = a.giveaway_id
+        GROUP BY a.giveaway_id
+    """)
+
+async def rebuild_giveaway_stats() -> int:
+    """Пересчитать giveaway_stats с нуля по nft_attempts; возвращает число розыгрышей"""
+    async with pool.transaction() as db:
+        await _rebuild_giveaway_stats(db)
+    await load_giveaway_counters()
+    return len(giveaway_counters)
+
+async def get_giveaway_stats(giveaway_id: int) -> dict:
+    """Получить статистику розыгрыша (из зеркала счетчиков)"""
+    counters = giveaway_counters.get(giveaway_id)
+    if counters is not None:
+        return dict(counters)
+    try:
+        row = await pool.fetchone(
+            "SELECT total_attempts, unique_users, wins, stars_collected FROM giveaway_stats WHERE giveaway_id = ?",
+            (giveaway_id,)
+        )
+        return dict(zip(GIVEAWAY_COUNTER_FIELDS, row)) if row else _empty_giveaway_counters()
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики: {e}")
+        return _empty_giveaway_counters()
+
+# === ЗАДАНИЯ РАССЫЛКИ ===
+async def create_broadcast_job(text: str, exclude_user: Optional[int], total: int) -> Optional[int]:
+    try:
+        async with pool.transaction() as db:
             cursor = await db.execute(
-                "SELECT COUNT(DISTINCT user_id) FROM nft_attempts WHERE giveaway_id = ?",
-                (giveaway_id,)
+                "INSERT INTO broadcast_jobs (text, exclude_user, total) VALUES (?, ?, ?)",
+                (text, exclude_user, total)
             )
-            unique = (await cursor.fetchone())[0]
-            
-            return {"total_attempts": total, "unique_users": unique}
+            return cursor.lastrowid
     except Exception as e:
-        logger.error(f"Ошибка получения статистики: {e}")
-        return {"total_attempts": 0, "unique_users": 0}
+        logger.error(f"Ошибка создания задания рассылки: {e}")
+        return None
+
+def announce_broadcast_job(job_id: int):
+    """Передать задание процессу, который ведет рассылки (режим воркеров)"""
+    _publish("broadcast", job_id)
+
+async def get_unfinished_broadcast_jobs() -> List[Tuple]:
+    """Задания, прерванные остановкой бота: (id, text, exclude_user, total, sent, failed, last_user_id)"""
+    try:
+        return await pool.fetchall(
+            """SELECT id, text, exclude_user, total, sent, failed, last_user_id
+               FROM broadcast_jobs WHERE status = 'running' ORDER BY id"""
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения незавершенных рассылок: {e}")
+        return []
+
+async def get_recent_broadcast_jobs(limit: int = 5) -> List[Tuple]:
+    """Последние задания: (id, status, total, sent, failed, created_at)"""
+    try:
+        return await pool.fetchall(
+            "SELECT id, status, total, sent, failed, created_at FROM broadcast_jobs ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения рассылок: {e}")
+        return []
+
+async def get_broadcast_delivered(job_id: int, after: int) -> set:
+    """user_id за чекпоинтом, которым это задание уже доставлялось"""
+    rows = await pool.fetchall(
+        "SELECT user_id FROM broadcast_deliveries WHERE job_id = ? AND user_id > ?",
+        (job_id, after)
+    )
+    return {row[0] for row in rows}
+
+async def record_broadcast_progress(
+    job_id: int,
+    deliveries: List[Tuple[int, str]],
+    last_user_id: Optional[int] = None,
+    unreachable: Optional[List[Tuple[int, str]]] = None,
+):
+    """
+    Записать пачку доставок [(user_id, 'sent'|'failed')] и счетчики задания
+    одной транзакцией; last_user_id сдвигает чекпоинт, unreachable —
+    [(user_id, причина)] пользователей, исключаемых из рассылок.
+    """
+    sent = sum(1 for _, status in deliveries if status == "sent")
+    failed = len(deliveries) - sent
+    async with pool.transaction() as db:
+        if deliveries:
+            await db.executemany(
+                "INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id, status) VALUES (?, ?, ?)",
+                [(job_id, user_id, status) for user_id, status in deliveries]
+            )
+        await db.execute(
+            """UPDATE broadcast_jobs
+               SET sent = sent + ?, failed = failed + ?,
+                   last_user_id = COALESCE(?, last_user_id), updated_at = CURRENT_TIMESTAMP
+               WHERE id = ?""",
+            (sent, failed, last_user_id, job_id)
+        )
+        if unreachable:
+            await db.executemany(
+                "UPDATE users SET unreachable = ? WHERE user_id = ?",
+                [(reason, user_id) for user_id, reason in unreachable]
+            )
+    for user_id, _ in unreachable or ():
+        _forget_user(user_id)
+
+async def finish_broadcast_job(job_id: int, status: str = "done"):
+    async with pool.transaction() as db:
+        await db.execute(
+            """UPDATE broadcast_jobs
+               SET status = ?, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ?""",
+            (status, job_id)
+        )
+
+# === FSM И БЛОКИРОВКИ ===
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    """(state, data JSON) по ключу FSM или None"""
+    return await pool.fetchone("SELECT state, data FROM fsm_storage WHERE key = ?", (key,))
+
+async def set_fsm_record(key: str, state: Optional[str], data: str):
+    """Записать состояние и данные; пустая запись удаляется"""
+    async def op(db):
+        if state is None and data == "{}":
+            await db.execute("DELETE FROM fsm_storage WHERE key = ?", (key,))
+        else:
+            await db.execute(
+                """INSERT INTO fsm_storage (key, state, data) VALUES (?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data""",
+                (key, state, data)
+            )
+    
+    await batcher.submit(op)
+
+async def acquire_shared_lock(name: str, key: str, ttl: float) -> bool:
+    """Взять блокировку name/key на ttl секунд; False — уже занята (и не истекла)"""
+    async def op(db):
+        now = time.time()
+        cursor = await db.execute(
+            """INSERT INTO shared_locks (name, key, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name, key) DO UPDATE SET expires_at = excluded.expires_at
+               WHERE shared_locks.expires_at <= ?""",
+            (name, key, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+    
+    try:
+        return await batcher.submit(op)
+    except Exception as e:
+        logger.error(f"Ошибка блокировки {name}/{key}: {e}")
+        return False
+
+async def release_shared_lock(name: str, key: str):
+    async def op(db):
+        await db.execute("DELETE FROM shared_locks WHERE name = ? AND key = ?", (name, key))
+    
+    try:
+        await batcher.submit(op)
+    except Exception as e:
+        logger.error(f"Ошибка снятия блокировки {name}/{key}: {e}")
+
+# === СТАТИСТИКА ДЛЯ АДМИНКИ ===
+# Триггеры ведут bot_stats в той же транзакции, что и запись в таблицу,
+# поэтому счетчики верны при любом пути записи и в любом процессе
+BOT_STATS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS trg_bot_stats_user_insert AFTER INSERT ON users BEGIN
+        UPDATE bot_stats SET
+            total_users = total_users + 1,
+            total_referrals = total_referrals + COALESCE(NEW.referrals_count, 0),
+            unreachable_users = unreachable_users + (NEW.unreachable IS NOT NULL)
+        WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_bot_stats_user_update
+    AFTER UPDATE OF referrals_count, unreachable ON users BEGIN
+        UPDATE bot_stats SET
+            total_referrals = total_referrals + COALESCE(NEW.referrals_count, 0) - COALESCE(OLD.referrals_count, 0),
+            unreachable_users = unreachable_users + (NEW.unreachable IS NOT NULL) - (OLD.unreachable IS NOT NULL)
+        WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_bot_stats_withdrawal_insert AFTER INSERT ON withdrawal_requests BEGIN
+        UPDATE bot_stats SET
+            total_withdrawals = total_withdrawals + 1,
+            pending_count = pending_count + (NEW.status = 'pending'),
+            pending_amount = pending_amount + CASE WHEN NEW.status = 'pending' THEN NEW.amount ELSE 0 END,
+            paid_count = paid_count + (NEW.status = 'paid'),
+            total_paid = total_paid + CASE WHEN NEW.status = 'paid' THEN NEW.amount ELSE 0 END
+        WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_bot_stats_withdrawal_update
+    AFTER UPDATE OF status, amount ON withdrawal_requests BEGIN
+        UPDATE bot_stats SET
+            pending_count = pending_count + (NEW.status = 'pending') - (OLD.status = 'pending'),
+            pending_amount = pending_amount
+                + CASE WHEN NEW.status = 'pending' THEN NEW.amount ELSE 0 END
+                - CASE WHEN OLD.status = 'pending' THEN OLD.amount ELSE 0 END,
+            paid_count = paid_count + (NEW.status = 'paid') - (OLD.status = 'paid'),
+            total_paid = total_paid
+                + CASE WHEN NEW.status = 'paid' THEN NEW.amount ELSE 0 END
+                - CASE WHEN OLD.status = 'paid' THEN OLD.amount ELSE 0 END
+        WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_bot_stats_payment_insert AFTER INSERT ON payments BEGIN
+        UPDATE bot_stats SET
+            total_payments = total_payments + 1,
+            revenue_total = revenue_total + NEW.amount
+        WHERE id = 1;
+    END""",
+)
+
+async def _rebuild_bot_stats(db: aiosqlite.Connection):
+    await db.execute("DELETE FROM bot_stats")
+    await db.execute("""
+        INSERT INTO bot_stats (
+            id, total_users, total_referrals, unreachable_users,
+            total_withdrawals, pending_count, paid_count, total_paid, pending_amount,
+            total_payments, revenue_total
+        )
+        SELECT 1, u.total, u.referrals, u.unreachable,
+               w.total, w.pending, w.paid, w.paid_amount, w.pending_amount,
+               p.total, p.amount
+        FROM (
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(referrals_count), 0) AS referrals,
+                   COALESCE(SUM(unreachable IS NOT NULL), 0) AS unreachable
+            FROM users
+        ) u, (
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(status = 'pending'), 0) AS pending,
+                   COALESCE(SUM(status = 'paid'), 0) AS paid,
+                   COALESCE(SUM(CASE WHEN status = 'paid' THEN amount END), 0) AS paid_amount,
+                   COALESCE(SUM(CASE WHEN status = 'pending' THEN amount END), 0) AS pending_amount
+            FROM withdrawal_requests
+        ) w, (
+            SELECT COUNT(*) AS total, COALESCE(SUM(amount), 0) AS amount FROM payments
+        ) p
+    """)
+
+async def rebuild_bot_stats():
+    """Пересчитать bot_stats с нуля по таблицам (если счетчики разошлись после ручных правок)"""
+    async with pool.transaction() as db:
+        await _rebuild_bot_stats(db)
+
+_bot_stats: Optional[dict] = None
+_bot_stats_expires = 0.0
+_bot_stats_lock = asyncio.Lock()
+
+async def get_bot_stats() -> Optional[dict]:
+    """
+    Сводная статистика бота одним запросом: итоги из bot_stats, «сегодня» —
+    диапазоны по индексам. Снимок кэшируется на STATS_CACHE_TTL секунд;
+    при ошибке — None.
+    """
+    global _bot_stats, _bot_stats_expires
+    
+    async with _bot_stats_lock:
+        if _bot_stats is not None and time.monotonic() < _bot_stats_expires:
+            return _bot_stats
+        try:
+            row = await pool.fetchone("""
+                SELECT s.total_users,
+                       (SELECT COUNT(*) FROM users WHERE joined_date >= date('now')),
+                       s.total_referrals, s.unreachable_users,
+                       s.total_withdrawals, s.pending_count, s.paid_count, s.total_paid, s.pending_amount,
+                       g.total, g.active, g.completed,
+                       s.total_payments, s.revenue_total,
+                       (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE created_at >= date('now'))
+                FROM bot_stats s, (
+                    SELECT COUNT(*) AS total,
+                           COALESCE(SUM(is_active = 1), 0) AS active,
+                           COALESCE(SUM(winner_id IS NOT NULL), 0) AS completed
+                    FROM nft_giveaways
+                ) g
+                WHERE s.id = 1
+            """)
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики бота: {e}")
+            return None
+        
+        keys = (
+            "total_users", "new_today", "total_referrals", "unreachable_users",
+            "total_withdrawals", "pending_count", "paid_count", "total_paid", "pending_amount",
+            "total_giveaways", "active_giveaways", "completed_giveaways",
+            "total_payments", "revenue_total", "revenue_today",
+        )
+        stats = dict(zip(keys, row))
+        current = active_giveaway.row
+        stats["current_attempts"] = (
+            giveaway_counters.get(current[0], {}).get("total_attempts", 0) if current else 0
+        )
+        
+        _bot_stats = stats
+        _bot_stats_expires = time.monotonic() + STATS_CACHE_TTL
+        return stats
+
+async def close_db():
+    """Дописать очередь и закрыть пул соединений (вызывается при остановке бота)"""
+    await batcher.stop()
+    await pool.close()
+
+async def _cli(command: str):
+    await init_db()
+    try:
+        if command == "rebuild-stats":
+            count = await rebuild_giveaway_stats()
+            await rebuild_bot_stats()
+            logger.info(f"Счетчики пересчитаны для {count} розыгрышей и сводной статистики")
+        elif command == "revenue":
+            for day, count, amount in await get_daily_revenue(30):
+                print(f"{day}: {count} платежей, {amount} ⭐")
+            for giveaway_id, count, amount in await get_revenue_by_giveaway(10):
+                print(f"Розыгрыш #{giveaway_id}: {count} платежей, {amount} ⭐")
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument(
+        "command", choices=["rebuild-stats", "revenue"],
+        help="rebuild-stats — пересчитать giveaway_stats и bot_stats, revenue — выручка по дням и розыгрышам"
+    )
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_cli(args.command))
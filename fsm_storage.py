@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Any, Dict, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE, REDIS_URL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+from database import get_fsm_record, set_fsm_record, acquire_shared_lock, release_shared_lock
+
+logger = logging.getLogger(__name__)
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+def _key_str(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM в общей базе SQLite (таблица fsm_storage) с кэшем чтения в процессе.
+    Кэш сквозной: запись сразу идет в базу и в кэш. Апдейты одного
+    пользователя обрабатывает один процесс, поэтому кэш не устаревает;
+    TTL ограничивает расхождение, если это не так.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Tuple[float, Optional[str], Dict[str, Any]]]" = OrderedDict()
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires_at, state, data = entry
+            if expires_at > time.monotonic():
+                self._cache.move_to_end(key)
+                return state, data
+            del self._cache[key]
+
+        record = await get_fsm_record(key)
+        state, data = (record[0], json.loads(record[1])) if record else (None, {})
+        self._remember(key, state, data)
+        return state, data
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._cache[key] = (time.monotonic() + self.ttl, state, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        try:
+            await set_fsm_record(key, state, json.dumps(data, ensure_ascii=False))
+        except Exception:
+            self._cache.pop(key, None)
+            raise
+        self._remember(key, state, data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = _key_str(key)
+        _, data = await self._load(name)
+        await self._store(name, _state_name(state), data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_key_str(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = _key_str(key)
+        state, _ = await self._load(name)
+        await self._store(name, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_key_str(key))
+        return data.copy()
+
+    async def clear(self, key: StorageKey) -> None:
+        """Сбросить состояние и данные одной записью"""
+        await self._store(_key_str(key), None, {})
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+async def clear_state(state: FSMContext):
+    """
+    Сбросить FSM пользователя. FSMContext.clear() пишет состояние и данные
+    по очереди — в SQLite это два ожидания групповой записи, здесь одно.
+    """
+    if isinstance(state.storage, SQLiteStorage):
+        await state.storage.clear(state.key)
+    else:
+        await state.clear()
+
+class SharedLocks:
+    """
+    Блокировки «уже обрабатывается» (анти-двойной клик) по имени и ключу.
+    ttl страхует от зависших блокировок, если процесс упал, не сняв их.
+    Базовая реализация — в памяти процесса.
+    """
+
+    def __init__(self):
+        self._held: Dict[Tuple[str, str], float] = {}
+
+    async def acquire(self, name: str, key: Any, ttl: float = 30.0) -> bool:
+        now = time.monotonic()
+        lock_key = (name, str(key))
+        if self._held.get(lock_key, 0.0) > now:
+            return False
+        self._held[lock_key] = now + ttl
+        return True
+
+    async def release(self, name: str, key: Any):
+        self._held.pop((name, str(key)), None)
+
+    async def close(self):
+        self._held.clear()
+
+class SQLiteLocks(SharedLocks):
+    """Блокировки в таблице shared_locks — видны всем процессам"""
+
+    async def acquire(self, name: str, key: Any, ttl: float = 30.0) -> bool:
+        return await acquire_shared_lock(name, str(key), ttl)
+
+    async def release(self, name: str, key: Any):
+        await release_shared_lock(name, str(key))
+
+class RedisLocks(SharedLocks):
+    """Блокировки через SET NX PX в Redis (или совместимом сервере)"""
+
+    def __init__(self, redis: Any, prefix: str = "lock"):
+        super().__init__()
+        self.redis = redis
+        self.prefix = prefix
+
+    async def acquire(self, name: str, key: Any, ttl: float = 30.0) -> bool:
+        try:
+            return bool(await self.redis.set(f"{self.prefix}:{name}:{key}", 1, nx=True, px=int(ttl * 1000)))
+        except Exception as e:
+            logger.error(f"Ошибка блокировки {name}/{key} в Redis: {e}")
+            return False
+
+    async def release(self, name: str, key: Any):
+        try:
+            await self.redis.delete(f"{self.prefix}:{name}:{key}")
+        except Exception as e:
+            logger.error(f"Ошибка снятия блокировки {name}/{key} в Redis: {e}")
+
+    async def close(self):
+        pass
+
+def create_storage(backend: str = FSM_STORAGE) -> Tuple[BaseStorage, SharedLocks]:
+    """FSM-хранилище и блокировки для backend: memory / sqlite / redis"""
+    if backend == "memory":
+        return MemoryStorage(), SharedLocks()
+    if backend == "sqlite":
+        return SQLiteStorage(FSM_CACHE_SIZE, FSM_CACHE_TTL), SQLiteLocks()
+    if backend == "redis":
+        # Пакет redis нужен только в этом режиме
+        from aiogram.fsm.storage.redis import RedisStorage
+        storage = RedisStorage.from_url(REDIS_URL)
+        return storage, RedisLocks(storage.redis)
+    raise ValueError(f"Неизвестное FSM-хранилище: {backend}")
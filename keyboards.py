@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
+from functools import lru_cache, wraps
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from urllib.parse import quote
 
+from config import KEYBOARD_CACHE_SIZE
+
+# Клавиатуры собираются один раз и переиспользуются: статические — при
+# импорте, с параметрами — через LRU. Возвращаемые объекты общие, их
+# нельзя изменять на месте.
+def _static(build):
+    """Собрать клавиатуру при импорте; функция отдает готовый объект"""
+    markup = build()
+    
+    @wraps(build)
+    def keyboard():
+        return markup
+    
+    return keyboard
+
+_cached = lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+
+@_static
 def main_menu_kb():
     """Главное меню с кнопкой NFT"""
     builder = InlineKeyboardBuilder()
@@ -13,12 +32,14 @@ def main_menu_kb():
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
 def back_to_menu_kb():
     """Кнопка назад в меню"""
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ В меню", callback_data="back_to_menu")
     return builder.as_markup()
 
+@_cached
 def share_link_kb(ref_link: str):
     """Кнопка для мгновенного шаринга ссылки"""
     builder = InlineKeyboardBuilder()
@@ -28,6 +49,7 @@ def share_link_kb(ref_link: str):
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
 def withdrawal_amounts_kb():
     """Клавиатура с фиксированными суммами вывода"""
     builder = InlineKeyboardBuilder()
@@ -39,12 +61,14 @@ def withdrawal_amounts_kb():
     builder.adjust(2, 2, 1, 1)
     return builder.as_markup()
 
+@_static
 def my_withdrawals_kb():
     """Кнопка возврата из заявок"""
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ В меню", callback_data="back_to_menu")
     return builder.as_markup()
 
+@_cached
 def admin_withdrawal_kb(request_id: int):
     """Клавиатура для админа с заявкой"""
     builder = InlineKeyboardBuilder()
@@ -54,6 +78,7 @@ def admin_withdrawal_kb(request_id: int):
     return builder.as_markup()
 
 # === НОВЫЕ КЛАВИАТУРЫ ДЛЯ NFT ===
+@_cached
 def nft_giveaway_kb(giveaway_id: int, bet_amount: int):
     """Клавиатура для участия в розыгрыше NFT"""
     builder = InlineKeyboardBuilder()
@@ -65,6 +90,7 @@ def nft_giveaway_kb(giveaway_id: int, bet_amount: int):
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
 def nft_spin_again_kb():
     """Клавиатура после проигрыша (можно добавить повторную попытку)"""
     builder = InlineKeyboardBuilder()
@@ -73,6 +99,7 @@ def nft_spin_again_kb():
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
 def admin_menu_kb():
     """Главное меню админа"""
     builder = InlineKeyboardBuilder()
@@ -83,12 +110,14 @@ def admin_menu_kb():
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
 def admin_back_kb():
     """Кнопка назад в админ-меню"""
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ Назад к админке", callback_data="admin_menu")
     return builder.as_markup()
 
+@_cached
 def admin_giveaway_manage_kb(has_active: bool):
     """Клавиатура управления розыгрышами"""
     builder = InlineKeyboardBuilder()
@@ -102,8 +131,43 @@ def admin_giveaway_manage_kb(has_active: bool):
     builder.adjust(1)
     return builder.as_markup()
 
+@_static
+def admin_broadcasts_kb():
+    """Экран прогресса рассылок"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Обновить", callback_data="admin_broadcast")
+    builder.button(text="⬅️ Назад", callback_data="admin_menu")
+    builder.adjust(1)
+    return builder.as_markup()
+
+@_static
 def admin_cancel_kb():
     """Кнопка отмены"""
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data="cancel_action")
     return builder.as_markup()
+
+def _benchmark(rounds: int = 20000):
+    """Сравнить сборку клавиатуры на каждый вызов и готовый объект"""
+    import timeit
+    import tracemalloc
+    
+    cases = [
+        ("main_menu_kb()", main_menu_kb.__wrapped__, main_menu_kb),
+        ("nft_giveaway_kb(1, 50)", lambda: nft_giveaway_kb.__wrapped__(1, 50), lambda: nft_giveaway_kb(1, 50)),
+    ]
+    for name, build, cached in cases:
+        for label, func in (("сборка", build), ("кэш", cached)):
+            seconds = timeit.timeit(func, number=rounds)
+            tracemalloc.start()
+            for _ in range(1000):
+                func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name:<24} {label:<7} {seconds / rounds * 1e6:8.2f} мкс/вызов, "
+                f"пик памяти на 1000 вызовов: {peak / 1024:.1f} КиБ"
+            )
+
+if __name__ == "__main__":
+    _benchmark()
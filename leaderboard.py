@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from typing import Optional, Dict, List, Tuple
+
+from config import LEADERBOARD_SIZE, LEADERBOARD_REFRESH
+import texts
+from database import get_top_referrers, get_referral_histogram, referral_listeners
+
+logger = logging.getLogger(__name__)
+
+# Не пересчитывать топ чаще, чем раз в столько секунд, даже при шквале рефералов
+MIN_REFRESH_GAP = 1.0
+
+def render_top(top_users: List[Tuple], size: int) -> Optional[str]:
+    """HTML-текст экрана «Топ рефералов»; None, если топ пуст"""
+    if not top_users:
+        return None
+
+    rows = texts.TOP_ROW.render_many(
+        {
+            "medal": texts.TOP_MEDALS.get(idx, "💠"),
+            "name": texts.top_name(user_id, username),
+            "refs": refs,
+            "stars": stars,
+        }
+        for idx, (user_id, username, refs, stars) in enumerate(top_users, 1)
+    )
+    return texts.TOP_HEADER.render(size=size) + rows + texts.TOP_FOOTER
+
+class FenwickTree:
+    """
+    Число пользователей по уровням 0, 1, 2, ... (уровень — число рефералов):
+    изменение уровня и сумма «уровень <= level» за O(log n). Размер —
+    степень двойки и удваивается, когда приходит уровень за границей.
+    """
+
+    def __init__(self, size: int = 1024):
+        capacity = 1
+        while capacity < size:
+            capacity *= 2
+        self._tree = [0] * (capacity + 1)
+        self.total = 0
+
+    @classmethod
+    def from_counts(cls, counts: Dict[int, int]) -> "FenwickTree":
+        """Построить за O(n) по словарю уровень -> количество"""
+        tree = cls(max(counts, default=0) + 1)
+        nodes = tree._tree
+        for level, count in counts.items():
+            nodes[level + 1] += count
+            tree.total += count
+        for i in range(1, len(nodes)):
+            parent = i + (i & -i)
+            if parent < len(nodes):
+                nodes[parent] += nodes[i]
+        return tree
+
+    def add(self, level: int, delta: int):
+        while level + 1 >= len(self._tree):
+            self._grow()
+        self.total += delta
+        i = level + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, level: int) -> int:
+        """Сколько пользователей на уровнях 0..level"""
+        i = min(level + 1, len(self._tree) - 1)
+        result = 0
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        return result
+
+    def _grow(self):
+        # Новые уровни пусты: старые узлы не меняются, а единственный узел,
+        # покрывающий весь новый диапазон (индекс 2 * capacity), равен total
+        capacity = len(self._tree) - 1
+        self._tree.extend([0] * capacity)
+        self._tree[2 * capacity] = self.total
+
+class Leaderboard:
+    """
+    Топ рефереров в памяти с готовым HTML для show_top.
+    Топ перечитывается раз в refresh_interval секунд и внеочередно, когда
+    начисление за реферала достает до порога топа. Для мест хранится
+    дерево Фенвика «число рефералов -> пользователей»: оно строится по БД
+    один раз при старте, дальше ведется по событиям (новые пользователи и
+    начисления, в том числе из других процессов); место и сдвиг — O(log n).
+    """
+
+    def __init__(self, size: int = 10, refresh_interval: float = 60.0):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.top: List[Tuple] = []
+        self.text: Optional[str] = None
+        self.cutoff = 0
+        self._levels = FenwickTree()
+        self._dirty: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        """Перечитать топ"""
+        top = await get_top_referrers(self.size)
+        self.top = top
+        self.cutoff = top[-1][2] if len(top) >= self.size else 0
+        self.text = render_top(top, self.size)
+
+    async def load_histogram(self):
+        self._levels = FenwickTree.from_counts(await get_referral_histogram())
+
+    def rank(self, referrals_count: int) -> int:
+        """Место пользователя с таким числом рефералов (1 — лучший)"""
+        return self._levels.total - self._levels.prefix(referrals_count) + 1
+
+    def note_referral(self, user_id: int, referrals_count: int):
+        """Учесть нового пользователя (0) или начисление: сдвинуть счетчики уровней и при нужде обновить топ"""
+        if referrals_count > 0:
+            self._levels.add(referrals_count - 1, -1)
+        self._levels.add(referrals_count, 1)
+
+        if referrals_count > 0 and referrals_count >= self.cutoff and self._dirty is not None:
+            self._dirty.set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._dirty = asyncio.Event()
+        await self.load_histogram()
+        await self.refresh()
+        referral_listeners.append(self.note_referral)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        referral_listeners.remove(self.note_referral)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления лидерборда: {e}")
+            await asyncio.sleep(MIN_REFRESH_GAP)
+
+leaderboard = Leaderboard(LEADERBOARD_SIZE, LEADERBOARD_REFRESH)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional, Any, Awaitable, Callable, Dict, Hashable, AsyncIterator
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject, CallbackQuery
+
+from fsm_storage import SharedLocks
+
+logger = logging.getLogger(__name__)
+
+class LockTimeout(asyncio.TimeoutError):
+    """Замок не удалось получить за отведенное время"""
+
+class KeyedLockManager:
+    """
+    asyncio.Lock на каждый ключ (например, пользователь + действие).
+    Замки хранятся в WeakValueDictionary: пока замок кто-то держит или ждет,
+    он жив, после — исчезает сам, словарь не растет. Считает захваты,
+    ожидания, таймауты и время ожидания.
+    """
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _get(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def locked(self, key: Hashable) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Захватить замок ключа; по таймауту — LockTimeout"""
+        lock = self._get(key)
+        started = time.monotonic()
+        if lock.locked():
+            self.contended += 1
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LockTimeout(f"замок {key!r} занят дольше {timeout} с") from None
+        else:
+            # Свободный замок берется сразу, без переключения задач
+            await lock.acquire()
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._locks),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "wait_avg": self.wait_total / self.acquired if self.acquired else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+class UserLockMiddleware(BaseMiddleware):
+    """
+    Последовательная обработка по пользователю для хендлеров с флагом
+    user_lock (имя действия): повторное нажатие ждет окончания первого,
+    а не отбрасывается. Если задан shared, замок берется и в общем слое
+    (другие процессы). Не дождались за timeout — «уже обрабатывается».
+    """
+
+    def __init__(
+        self,
+        manager: KeyedLockManager,
+        shared: Optional[SharedLocks] = None,
+        timeout: float = 10.0,
+        shared_ttl: float = 60.0,
+    ):
+        self.manager = manager
+        self.shared = shared
+        self.timeout = timeout
+        self.shared_ttl = shared_ttl
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        action = get_flag(data, "user_lock")
+        user = data.get("event_from_user")
+        if action is None or user is None:
+            return await handler(event, data)
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            async with self.manager.lock((action, user.id), self.timeout):
+                if self.shared is not None:
+                    await self._acquire_shared(action, user.id, deadline)
+                try:
+                    return await handler(event, data)
+                finally:
+                    if self.shared is not None:
+                        await self.shared.release(action, user.id)
+        except LockTimeout:
+            logger.warning(f"Замок {action} пользователя {user.id} не получен за {self.timeout} с")
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Запрос уже обрабатывается!", show_alert=True)
+            return None
+
+    async def _acquire_shared(self, action: str, user_id: int, deadline: float):
+        while not await self.shared.acquire(action, user_id, self.shared_ttl):
+            if time.monotonic() >= deadline:
+                self.manager.timeouts += 1
+                raise LockTimeout(f"общий замок {action}/{user_id} занят")
+            await asyncio.sleep(0.05)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import User
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором, если get_me не удался
+RETRY_DELAY = 30.0
+
+class LatencyStats:
+    """
+    Время обработки (секунды): число замеров, среднее, максимум, p95 по
+    последним window замерам и сколько раз превышен порог slow.
+    """
+
+    def __init__(self, slow: float, window: int = 1000):
+        self.slow = slow
+        self.count = 0
+        self.slow_count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent: "deque[float]" = deque(maxlen=window)
+
+    def record(self, seconds: float) -> bool:
+        """Учесть замер; True — он медленнее порога"""
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+        is_slow = seconds >= self.slow
+        if is_slow:
+            self.slow_count += 1
+        return is_slow
+
+    def stats(self) -> dict:
+        recent = sorted(self._recent)
+        return {
+            "count": self.count,
+            "slow": self.slow_count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p95": recent[int(len(recent) * 0.95) - 1] if recent else 0.0,
+        }
+
+class BotRuntime:
+    """
+    Данные процесса, нужные хендлерам: профиль бота из get_me.
+    Запрашивается один раз при старте и обновляется раз в refresh_interval
+    секунд. Хендлеры получают объект через DI диспетчера (dp["runtime"]).
+    """
+
+    def __init__(self, bot: Bot, refresh_interval: float = 3600.0):
+        self.bot = bot
+        self.refresh_interval = refresh_interval
+        self.me: Optional[User] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> User:
+        self.me = await self.bot.get_me()
+        return self.me
+
+    async def get_me(self) -> User:
+        """Профиль бота из кэша (запрос к Telegram, только если его еще нет)"""
+        if self.me is None:
+            return await self.refresh()
+        return self.me
+
+    async def ref_link(self, user_id: int) -> str:
+        """Реферальная ссылка пользователя"""
+        me = await self.get_me()
+        return f"https://t.me/{me.username}?start={user_id}"
+
+    async def start(self):
+        if self._task is not None:
+            return
+        try:
+            await self.refresh()
+            logger.info(f"🤖 Бот @{self.me.username} (id {self.me.id})")
+        except Exception as e:
+            logger.error(f"Ошибка получения профиля бота: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval if self.me is not None else RETRY_DELAY)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления профиля бота: {e}")
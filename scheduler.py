@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DelayedCall = Callable[..., Awaitable[Any]]
+
+class DelayedQueue:
+    """
+    Отложенные вызовы (например, показ результата после анимации) на одной
+    фоновой задаче: куча по времени срабатывания, без sleep в хендлерах.
+    Одновременно выполняется не больше concurrency вызовов; при остановке
+    оставшиеся вызываются сразу, чтобы ответы не потерялись.
+    """
+
+    def __init__(self, concurrency: int = 20):
+        self._heap: List[Tuple[float, int, DelayedCall, tuple]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._running: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.scheduled = 0
+        self.fired = 0
+        self.failed = 0
+
+    def call_later(self, delay: float, func: DelayedCall, *args: Any):
+        """Вызвать await func(*args) через delay секунд"""
+        heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), next(self._seq), func, args))
+        self.scheduled += 1
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Не дожидаясь срока: после остановки их уже никто не вызовет
+        while self._heap:
+            _, _, func, args = heapq.heappop(self._heap)
+            await self._spawn(func, args)
+        if self._running:
+            await asyncio.wait(list(self._running))
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._heap[0][0] <= time.monotonic():
+                _, _, func, args = heapq.heappop(self._heap)
+                await self._spawn(func, args)
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _spawn(self, func: DelayedCall, args: tuple):
+        # Ждет свободного места: все сработавшие вызовы не стартуют разом
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._call(func, args))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _call(self, func: DelayedCall, args: tuple):
+        try:
+            await func(*args)
+            self.fired += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка отложенного вызова {getattr(func, '__name__', func)}: {e}")
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._heap),
+            "running": len(self._running),
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "failed": self.failed,
+        }
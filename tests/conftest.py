@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS = os.path.dirname(os.path.abspath(__file__))
+for path in (ROOT, TESTS):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Бот в тестах ходит в локальный фейковый Bot API (tests/fake_telegram.py);
+# адрес задается до импорта config
+os.environ.setdefault("TELEGRAM_API_URL", f"http://127.0.0.1:{_free_port()}")
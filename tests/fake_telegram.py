@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Фейковый Bot API на aiohttp для тестов: бот ходит сюда через
+TELEGRAM_API_URL. На каждый чат можно заранее задать ответы (429, 403,
+«зависший» запрос), остальные sendMessage считаются доставленными.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+BOT_TOKEN = "123456:TEST"
+
+def retry_after(seconds: int) -> Tuple[int, Dict[str, Any]]:
+    return 429, {
+        "ok": False, "error_code": 429,
+        "description": f"Too Many Requests: retry after {seconds}",
+        "parameters": {"retry_after": seconds},
+    }
+
+def blocked() -> Tuple[int, Dict[str, Any]]:
+    return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+
+# Запрос не получает ответа, пока клиент не отменит его (или сервер не остановят)
+HANG = (0, {})
+
+class FakeTelegram:
+    def __init__(self):
+        self.sent: List[int] = []
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.send_times: Dict[int, List[float]] = defaultdict(list)
+        self.hanging: List[int] = []
+        self._script: Dict[int, Deque[Tuple[int, Dict[str, Any]]]] = defaultdict(deque)
+        self._released = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self._message_id = 0
+
+    def script(self, chat_id: int, *responses: Tuple[int, Dict[str, Any]]):
+        """Следующие ответы на sendMessage в чат chat_id (по одному на запрос)"""
+        self._script[chat_id].extend(responses)
+
+    async def start(self, url: str):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        host, port = url.rsplit("//", 1)[1].split(":")
+        await web.TCPSite(self._runner, host, int(port)).start()
+
+    async def stop(self):
+        self._released.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((method, params))
+        if method == "sendMessage":
+            return await self._send_message(params)
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": int(BOT_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Test", "username": "test_bot",
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _send_message(self, params: Dict[str, Any]) -> web.Response:
+        chat_id = int(params["chat_id"])
+        self.send_times[chat_id].append(time.monotonic())
+        if self._script[chat_id]:
+            status, payload = self._script[chat_id].popleft()
+            if (status, payload) == HANG:
+                self.hanging.append(chat_id)
+                await self._released.wait()
+                raise web.HTTPServiceUnavailable()
+            return web.json_response(payload, status=status)
+        self.sent.append(chat_id)
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }})
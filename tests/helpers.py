@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import database
+
+@asynccontextmanager
+async def temp_database(path: str) -> AsyncIterator[None]:
+    """Пул и групповая запись модуля database на файле path (на время блока)"""
+    database.pool = database.ConnectionPool(path, 2, database.STORAGE_PROFILE)
+    database.batcher = database.WriteBatcher(database.pool, 5, 100)
+    database.user_cache.clear()
+    await database.init_db(maintenance=False)
+    try:
+        yield
+    finally:
+        await database.close_db()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Гонка за победу: несколько процессов (как воркеры workers.py), у каждого
+свой пул и свой писатель, одновременно шлют выигрышные броски claim_win
+в один розыгрыш на общей временной базе. Победитель должен быть один.
+
+Запуск: python tests/stress_claim.py --processes 4 --spins 500
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+from tempfile import TemporaryDirectory
+from typing import Any, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from helpers import temp_database
+
+async def _prepare(path: str) -> int:
+    async with temp_database(path):
+        await database.add_user(1, "stress", "Stress")
+        return await database.create_giveaway(1, "https://t.me/nft/stress", 1)
+
+async def _read_giveaway(path: str, giveaway_id: int) -> Tuple:
+    async with temp_database(path):
+        return await database.pool.fetchone(
+            "SELECT winner_id, is_active FROM nft_giveaways WHERE id = ?", (giveaway_id,)
+        )
+
+async def _claim(path: str, giveaway_id: int, spins: int, first_user: int, barrier: Any) -> List[int]:
+    async with temp_database(path):
+        # Все процессы стартуют одновременно, когда каждый открыл свой пул
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+        results = await asyncio.gather(
+            *(database.claim_win(giveaway_id, first_user + i) for i in range(spins))
+        )
+        return [first_user + i for i, won in enumerate(results) if won]
+
+def _claimer(path: str, giveaway_id: int, spins: int, first_user: int, barrier: Any, results: Any):
+    try:
+        results.put(asyncio.run(_claim(path, giveaway_id, spins, first_user, barrier)))
+    except Exception as e:
+        results.put(repr(e))
+
+def run(processes: int, spins: int) -> Tuple[List[int], Tuple]:
+    """(победители по ответам claim_win, (winner_id, is_active) из БД)"""
+    ctx = multiprocessing.get_context("spawn")
+    with TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "stress.db")
+        giveaway_id = asyncio.run(_prepare(path))
+        barrier = ctx.Barrier(processes)
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=_claimer, args=(path, giveaway_id, spins, 1000 + index * spins, barrier, results))
+            for index in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            outcomes = [results.get(timeout=120) for _ in workers]
+        finally:
+            for worker in workers:
+                worker.join()
+        errors = [outcome for outcome in outcomes if not isinstance(outcome, list)]
+        if errors:
+            raise RuntimeError(f"Ошибки в процессах: {errors}")
+        winners = [user_id for outcome in outcomes for user_id in outcome]
+        row = asyncio.run(_read_giveaway(path, giveaway_id))
+    return winners, row
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Гонка claim_win между процессами")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--spins", type=int, default=500, help="бросков на процесс")
+    args = parser.parse_args()
+
+    winners, (winner_id, is_active) = run(args.processes, args.spins)
+    print(f"Бросков: {args.processes * args.spins}, победителей: {len(winners)}, "
+          f"в БД: winner_id={winner_id}, is_active={is_active}")
+    sys.exit(0 if len(winners) == 1 and winners[0] == winner_id and is_active == 0 else 1)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+from collections import Counter
+from tempfile import TemporaryDirectory
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import broadcast
+import database
+from broadcast import Broadcaster, BroadcastJobs
+from config import TELEGRAM_API_URL
+from fake_telegram import BOT_TOKEN, HANG, FakeTelegram, blocked, retry_after
+from helpers import temp_database
+
+USERS = list(range(1, 11))
+
+async def _job_status(job_id: int) -> str:
+    for row in await database.get_recent_broadcast_jobs(limit=100):
+        if row[0] == job_id:
+            return row[1]
+    return ""
+
+async def _done(job_id: int) -> bool:
+    return await _job_status(job_id) == "done"
+
+async def _wait(predicate, timeout: float = 10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "не дождались"
+        await asyncio.sleep(0.02)
+
+def _scenario(body):
+    """Запустить body(fake, bot) на временной базе с USERS и фейковым Bot API"""
+    async def main():
+        with TemporaryDirectory() as workdir:
+            async with temp_database(os.path.join(workdir, "bot.db")):
+                for user_id in USERS:
+                    await database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+                fake = FakeTelegram()
+                await fake.start(TELEGRAM_API_URL)
+                bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+                try:
+                    await body(fake, bot)
+                finally:
+                    await bot.session.close()
+                    await fake.stop()
+    asyncio.run(main())
+
+def _jobs(bot: Bot, **kwargs) -> BroadcastJobs:
+    broadcaster = Broadcaster(
+        bot, rate=kwargs.pop("rate", 1000), concurrency=kwargs.pop("concurrency", 4), per_chat_interval=0
+    )
+    return BroadcastJobs(broadcaster, **kwargs)
+
+def test_retry_after_waits_and_resends():
+    async def body(fake: FakeTelegram, bot: Bot):
+        fake.script(3, retry_after(1))
+        jobs = _jobs(bot, rate=5)
+        job_id = await jobs.start("hello")
+        progress = jobs.active[job_id]
+        await _wait(lambda: _done(job_id))
+
+        assert sorted(fake.sent) == USERS
+        first, second = fake.send_times[3]
+        assert second - first >= 1.0
+        assert progress.retries == 1
+        assert (progress.sent, progress.failed) == (len(USERS), 0)
+
+        # После паузы ведро пустое: отправка идет с темпом rate, а не пачкой на весь запас
+        resumed = first + 1.0
+        burst = [t for times in fake.send_times.values() for t in times if resumed <= t < resumed + 0.3]
+        assert len(burst) <= 2
+
+    _scenario(body)
+
+def test_blocked_user_is_pruned():
+    async def body(fake: FakeTelegram, bot: Bot):
+        fake.script(5, blocked())
+        jobs = _jobs(bot)
+        job_id = await jobs.start("hello")
+        await _wait(lambda: _done(job_id))
+
+        assert 5 not in fake.sent
+        assert len(fake.send_times[5]) == 1
+        assert await database.count_users(reachable_only=True) == len(USERS) - 1
+        assert (await database.get_user(5))[7] == "blocked"
+
+        # Следующая рассылка заблокировавшему уже не уходит
+        job_id = await jobs.start("again")
+        await _wait(lambda: _done(job_id))
+        assert len(fake.send_times[5]) == 1
+
+    _scenario(body)
+
+def test_resume_skips_delivered():
+    async def body(fake: FakeTelegram, bot: Bot):
+        fake.script(8, HANG)
+        jobs = _jobs(bot, concurrency=1, chunk_size=5, flush_size=1)
+        job_id = await jobs.start("hello")
+
+        async def stuck() -> bool:
+            return bool(fake.hanging)
+        await _wait(stuck)
+        await jobs.stop()
+        # Чекпоинт на 5, но 6 и 7 уже записаны как доставленные
+        assert sorted(fake.sent) == list(range(1, 8))
+        assert await _job_status(job_id) == "running"
+
+        # «Перезапуск»: новый экземпляр продолжает с чекпоинта
+        jobs = _jobs(bot, concurrency=1, chunk_size=5, flush_size=1)
+        await jobs.resume()
+        await _wait(lambda: _done(job_id))
+
+        assert Counter(fake.sent) == Counter(USERS)
+        row = (await database.get_recent_broadcast_jobs(limit=1))[0]
+        assert row[1:5] == ("done", len(USERS), len(USERS), 0)
+
+    _scenario(body)
+
+def test_stop_during_flush_keeps_batch(monkeypatch):
+    record = database.record_broadcast_progress
+    writing = asyncio.Event()
+
+    async def slow_record(job_id, deliveries, last_user_id=None, unreachable=None):
+        # Первая пачка пишется медленно, чтобы остановка пришлась на запись
+        if deliveries and not writing.is_set():
+            writing.set()
+            await asyncio.sleep(0.3)
+        await record(job_id, deliveries, last_user_id, unreachable)
+
+    monkeypatch.setattr(broadcast, "record_broadcast_progress", slow_record)
+
+    async def body(fake: FakeTelegram, bot: Bot):
+        jobs = _jobs(bot, concurrency=1, chunk_size=5, flush_size=3)
+        job_id = await jobs.start("hello")
+        await asyncio.wait_for(writing.wait(), timeout=10)
+        await jobs.stop()
+        assert await _job_status(job_id) == "running"
+        delivered = list(fake.sent)
+
+        jobs = _jobs(bot, concurrency=1, chunk_size=5, flush_size=3)
+        await jobs.resume()
+        await _wait(lambda: _done(job_id))
+
+        assert Counter(fake.sent) == Counter(USERS)
+        assert len(delivered) >= 3
+        row = (await database.get_recent_broadcast_jobs(limit=1))[0]
+        assert row[1:5] == ("done", len(USERS), len(USERS), 0)
+
+    _scenario(body)
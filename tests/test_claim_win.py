@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+import stress_claim
+
+def test_single_winner_across_processes():
+    winners, (winner_id, is_active) = stress_claim.run(processes=4, spins=250)
+    assert len(winners) == 1
+    assert winners[0] == winner_id
+    assert is_active == 0
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import random
+from collections import Counter
+
+from leaderboard import FenwickTree, Leaderboard
+
+def _brute_rank(counts: Counter, referrals_count: int) -> int:
+    return sum(users for level, users in counts.items() if level > referrals_count) + 1
+
+def test_fenwick_grows_and_matches_prefix_sums():
+    counts = Counter({0: 5, 3: 2, 7: 1})
+    tree = FenwickTree.from_counts(dict(counts))
+    rng = random.Random(8)
+    for _ in range(2000):
+        level = rng.choice([rng.randrange(10), rng.randrange(5000)])
+        delta = rng.choice([1, 1, -1]) if counts[level] else 1
+        counts[level] += delta
+        tree.add(level, delta)
+    assert tree.total == sum(counts.values())
+    for level in [0, 1, 9, 100, 4999, 10 ** 6]:
+        assert tree.prefix(level) == sum(users for l, users in counts.items() if l <= level)
+
+def test_rank_follows_referral_events():
+    board = Leaderboard(size=3)
+    board._levels = FenwickTree.from_counts({0: 4, 2: 1})
+    users = {1: 0, 2: 0, 3: 0, 4: 0, 5: 2}
+    rng = random.Random(80)
+    for user_id in range(6, 40):
+        users[user_id] = 0
+        board.note_referral(user_id, 0)
+    for _ in range(500):
+        user_id = rng.choice(list(users))
+        users[user_id] += 1
+        board.note_referral(user_id, users[user_id])
+    counts = Counter(users.values())
+    for referrals_count in set(users.values()) | {0, 10 ** 4}:
+        assert board.rank(referrals_count) == _brute_rank(counts, referrals_count)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+
+import database
+from helpers import temp_database
+
+async def _fresh_stats() -> dict:
+    database._bot_stats = None
+    return await database.get_bot_stats()
+
+def test_counters_match_recount():
+    async def main():
+        with TemporaryDirectory() as workdir:
+            async with temp_database(os.path.join(workdir, "bot.db")):
+                for user_id in range(1, 6):
+                    await database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+                await database.add_user(1, "user1", "User 1")
+                for _ in range(3):
+                    await database.credit_referral(1)
+                await database.credit_referral(2)
+                await database.record_broadcast_progress(1, [], unreachable=[(4, "blocked")])
+
+                _, first = await database.create_withdrawal_request(1, 1)
+                _, second = await database.create_withdrawal_request(1, 2)
+                await database.update_withdrawal_status(first["request_id"], "paid")
+                await database.update_withdrawal_status(second["request_id"], "rejected")
+                await database.create_withdrawal_request(2, 1)
+
+                await database.record_payment("c1", None, 3, 5, "XTR", "p", create_attempt=False)
+                await database.record_payment("c1", None, 3, 5, "XTR", "p", create_attempt=False)
+                await database.record_payment("c2", None, 5, 7, "XTR", "p", create_attempt=False)
+
+                stats = await _fresh_stats()
+                assert (stats["total_users"], stats["new_today"]) == (5, 5)
+                assert (stats["total_referrals"], stats["unreachable_users"]) == (4, 1)
+                assert (stats["total_withdrawals"], stats["pending_count"], stats["paid_count"]) == (3, 1, 1)
+                assert (stats["total_paid"], stats["pending_amount"]) == (1, 1)
+                assert (stats["total_payments"], stats["revenue_total"], stats["revenue_today"]) == (2, 12, 12)
+
+                await database.rebuild_bot_stats()
+                assert await _fresh_stats() == stats
+
+    asyncio.run(main())
+
+def test_today_counts_use_indexes():
+    async def main():
+        with TemporaryDirectory() as workdir:
+            async with temp_database(os.path.join(workdir, "bot.db")):
+                for sql in (
+                    "SELECT COUNT(*) FROM users WHERE joined_date >= date('now')",
+                    "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE created_at >= date('now')",
+                ):
+                    plan = " ".join(row[-1] for row in await database.pool.fetchall("EXPLAIN QUERY PLAN " + sql))
+                    assert "USING" in plan and "INDEX" in plan, plan
+
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import CallbackQuery, Message, PreCheckoutQuery
+from aiohttp.test_utils import TestClient, TestServer
+
+from config import TELEGRAM_API_URL
+from fake_telegram import BOT_TOKEN, FakeTelegram
+from webhook import ConcurrencyLimitMiddleware, build_app
+
+PATH = "/webhook"
+SECRET = "s3cret"
+USER = {"id": 42, "is_bot": False, "first_name": "Test", "username": "tester"}
+
+# Апдейты в том виде, в каком их присылает Telegram
+START = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10, "date": 1700000000, "chat": {"id": 42, "type": "private"},
+        "from": USER, "text": "/start",
+    },
+}
+CALLBACK = {
+    "update_id": 2,
+    "callback_query": {
+        "id": "777", "from": USER, "chat_instance": "1", "data": "profile",
+        "message": {
+            "message_id": 11, "date": 1700000000, "chat": {"id": 42, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "Test"}, "text": "menu",
+        },
+    },
+}
+PRE_CHECKOUT = {
+    "update_id": 3,
+    "pre_checkout_query": {
+        "id": "pcq-1", "from": USER, "currency": "XTR", "total_amount": 5,
+        "invoice_payload": "nft_1_42",
+    },
+}
+
+def _dispatcher(release: asyncio.Event, handled: list) -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(1))
+
+    @dp.message(F.text == "/start")
+    async def start(message: Message):
+        handled.append("start")
+        await release.wait()
+
+    @dp.callback_query()
+    async def callback(query: CallbackQuery):
+        handled.append("callback")
+
+    @dp.pre_checkout_query()
+    async def pre_checkout(query: PreCheckoutQuery):
+        handled.append("pre_checkout")
+        await query.answer(ok=True)
+
+    return dp
+
+def _scenario(body):
+    """Запустить body(client, fake, handled, release) против build_app на тестовом сервере"""
+    async def main():
+        fake = FakeTelegram()
+        await fake.start(TELEGRAM_API_URL)
+        bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+        release = asyncio.Event()
+        handled: list = []
+        app = build_app(_dispatcher(release, handled), bot, PATH, SECRET)
+        try:
+            async with TestClient(TestServer(app)) as client:
+                try:
+                    await body(client, fake, handled, release)
+                finally:
+                    release.set()
+        finally:
+            await bot.session.close()
+            await fake.stop()
+    asyncio.run(main())
+
+def _post(client: TestClient, update: dict, secret: str = SECRET):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    return client.post(PATH, json=update, headers=headers)
+
+def test_secret_token_is_required():
+    async def body(client, fake, handled, release):
+        release.set()
+        assert (await _post(client, START, secret="")).status == 401
+        assert (await _post(client, START, secret="wrong")).status == 401
+        assert handled == []
+
+        assert (await _post(client, START)).status == 200
+        assert (await _post(client, CALLBACK)).status == 200
+        assert handled == ["start", "callback"]
+
+    _scenario(body)
+
+def test_pre_checkout_bypasses_concurrency_limit():
+    async def body(client, fake, handled, release):
+        # /start занимает единственное место и висит до release
+        start = asyncio.ensure_future(_post(client, START))
+        callback = asyncio.ensure_future(_post(client, CALLBACK))
+        while "start" not in handled:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert handled == ["start"]
+
+        started = time.monotonic()
+        response = await asyncio.wait_for(_post(client, PRE_CHECKOUT), timeout=5)
+        assert response.status == 200
+        assert time.monotonic() - started < 1
+        assert handled == ["start", "pre_checkout"]
+        assert [method for method, _ in fake.calls] == ["answerPreCheckoutQuery"]
+        assert not start.done() and not callback.done()
+
+        release.set()
+        assert (await start).status == 200
+        assert (await callback).status == 200
+        assert handled == ["start", "pre_checkout", "callback"]
+
+    _scenario(body)
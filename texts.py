@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+import sys
+from html import escape
+from string import Formatter
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+
+class Template:
+    """
+    HTML-шаблон с полями {name} и {name:spec}. Разбирается один раз при
+    создании: статические куски интернируются, при рендере поля
+    форматируются, экранируются (html.escape) и склеиваются одним join.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self._parts: List[Tuple[str, Optional[str], str]] = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if conversion is not None:
+                raise ValueError(f"Преобразование !{conversion} в шаблоне не поддерживается")
+            self._parts.append((sys.intern(literal), field, spec or ""))
+
+    def render(self, **values: Any) -> str:
+        return "".join(self._chunks(values))
+
+    def render_many(self, rows: Iterable[Mapping[str, Any]]) -> str:
+        """Отрендерить шаблон для каждой строки и склеить результат за один проход"""
+        return "".join(chunk for values in rows for chunk in self._chunks(values))
+
+    def _chunks(self, values: Mapping[str, Any]) -> Iterable[str]:
+        for literal, field, spec in self._parts:
+            if literal:
+                yield literal
+            if field is not None:
+                yield escape(format(values[field], spec))
+
+def user_name(full_name: Optional[str], default: str = "Без имени") -> str:
+    return full_name or default
+
+def short_date(timestamp: Optional[str], length: int = 10) -> str:
+    """Дата из TIMESTAMP SQLite ('2024-01-31 12:00:00' -> '2024-01-31')"""
+    return timestamp[:length] if timestamp else "Неизвестно"
+
+# === ПОЛЬЗОВАТЕЛЬ ===
+WELCOME = Template(
+    "<b>🌟 Добро пожаловать в StarsZone!</b>\n\n"
+    "Привет, <b>{full_name}</b>! Рады видеть тебя здесь.\n\n"
+    "<blockquote>💰 Принцип максимально прост:\n"
+    "• Получите свою реферальную ссылку\n"
+    "• Поделитесь ею с другом\n"
+    "• Мгновенно получите 1 ⭐ за каждого друга!</blockquote>\n\n"
+    "<b>Начинайте зарабатывать прямо сейчас!</b>"
+)
+
+REFERRAL_CREDITED = Template(
+    "⭐ <b>Заработана 1 Stars!</b>\n\n"
+    "<blockquote>Пользователь @{username} присоединился по вашей ссылке!</blockquote>\n\n"
+    "💎 Ваш баланс: <b>{balance} ⭐ Stars</b>"
+)
+
+PROFILE = Template(
+    "👤 <b>Мой профиль</b>\n\n"
+    "<blockquote>"
+    "🆔 ID: <code>{user_id}</code>\n"
+    "👤 Username: @{username}\n"
+    "📛 Имя: <b>{full_name}</b>\n"
+    "📅 Дата: {joined}"
+    "</blockquote>\n\n"
+    "<blockquote>"
+    "📊 Моя статистика:\n"
+    "├ Приглашено: <b>{referrals} человек</b>\n"
+    "├ Заработано: <b>{stars} ⭐ Stars</b>\n"
+    "└ Место в топе: <b>#{rank}</b>"
+    "</blockquote>\n\n"
+    "<i>Каждый новый друг — новая звезда!</i>"
+)
+
+MAIN_MENU = Template(
+    "<b>🏠 Главное меню</b>\n\n"
+    "Привет, <b>{full_name}</b>! 👋\n\n"
+    "<blockquote>"
+    "💎 Баланс: <b>{stars} ⭐ звезд</b>\n"
+    "👥 Рефералы: <b>{referrals} человек</b>\n"
+    "🎯 Каждый друг = 1 звезда!\n"
+    "🎰 NFT розыгрыши активны!"
+    "</blockquote>\n\n"
+    "<b>Выберите действие:</b>"
+)
+
+HOW_TO_EARN = (
+    "💰 <b>КАК ЗАРАБОТАТЬ ЗВЕЗДЫ</b>\n\n"
+    "<blockquote>"
+    "<b>ШАГ 1:</b> Получите свою ссылку\n"
+    "└ Нажмите кнопку 'Поделится'\n\n"
+    "<b>ШАГ 2:</b> Поделитесь с другом\n"
+    "└ Отправьте ссылку в ЛС или чат\n\n"
+    "<b>ШАГ 3:</b> Получите звезду мгновенно!\n"
+    "└ Как только друг присоединится — вы получаете 1 ⭐"
+    "</blockquote>\n\n"
+    "<blockquote>"
+    "💡 <b>Где размещать ссылку?</b>\n"
+    "• В Telegram чатах (тематических)\n"
+    "• В соцсетях (ВК, Instagram, TikTok)\n"
+    "• На форумах и в комментариях\n"
+    "• Расскажите друзьям лично!"
+    "</blockquote>\n\n"
+    "<b>⚡ Ваша ссылка готова — начинайте зарабатывать!</b>"
+)
+
+# === ТОП ===
+TOP_HEADER = Template("🏆 <b>ТОП-{size} РЕФЕРЕРОВ</b>\n\n<blockquote>")
+TOP_ROW = Template("{medal} <b>{name}</b> │ {refs} чел. │ {stars}⭐\n")
+TOP_FOOTER = (
+    "</blockquote>\n\n"
+    "<blockquote>🎯 Ваша цель: попасть в топ и заработать максимум звезд!</blockquote>"
+)
+TOP_MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+def top_name(user_id: int, username: Optional[str]) -> str:
+    return f"@{username}" if username else f"ID:{user_id}"
+
+# === ВЫВОД ===
+WITHDRAWAL_ADMIN = Template(
+    "🆔 <b>Заявка на вывод #{request_id}</b>\n\n"
+    "<blockquote>"
+    "👤 Пользователь: <a href='tg://user?id={user_id}'>{full_name}</a>\n"
+    "🆔 ID: <code>{user_id}</code>\n"
+    "💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
+    "📊 Баланс: {balance} | Рефералов: {referrals}"
+    "</blockquote>\n\n"
+)
+
+WITHDRAW_MENU = Template(
+    "💸 <b>Вывод Stars</b>\n\n"
+    "<blockquote>"
+    "📊 Ваш баланс: <b>{stars} ⭐</b>\n"
+    "👥 Рефералов: <b>{referrals} человек</b>\n"
+    "</blockquote>\n\n"
+    "<blockquote>Выберите сумму для вывода:</blockquote>"
+)
+
+WITHDRAWAL_CREATED = Template(
+    "✅ <b>Заявка #{request_id} создана!</b>\n\n"
+    "<blockquote>"
+    "💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
+    "⏳ Статус: В обработке\n"
+    "📅 Дата: {created}"
+    "</blockquote>\n\n"
+    "<blockquote>⏰ Обычно выплата занимает 1-24 часа</blockquote>\n\n"
+    "💎 Когда заявку одобрят — вы получите уведомление!"
+)
+
+MY_WITHDRAWALS_HEADER = "📋 <b>Мои заявки на вывод</b>\n\n"
+MY_WITHDRAWALS_ROW = Template(
+    "<blockquote>"
+    "🆔 #{request_id} | 💰 {amount} ⭐\n"
+    "📅 {date} | {status_emoji} <b>{status}</b>"
+    "</blockquote>\n"
+)
+WITHDRAWAL_STATUS_EMOJI = {"pending": "⏳", "paid": "✅", "rejected": "❌"}
+WITHDRAWAL_STATUS_TEXT = {"pending": "В обработке", "paid": "Выплачено", "rejected": "Отклонено"}
+
+WITHDRAWAL_PAID = Template(
+    "🎉 <b>Заявка #{request_id} выплачена!</b>\n\n"
+    "<blockquote>"
+    "💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
+    "✅ Статус: Выплачено\n"
+    "🎊 Средства отправлены на ваш кошелек"
+    "</blockquote>\n\n"
+    "💎 Спасибо за использование бота!"
+)
+
+WITHDRAWAL_REJECTED = Template(
+    "❌ <b>Заявка #{request_id} отклонена</b>\n\n"
+    "<blockquote>"
+    "💰 Сумма: <b>{amount} ⭐ Stars</b>\n"
+    "📛 Статус: Отклонено\n"
+    "💎 Средства возвращены на ваш баланс\n"
+    "❓ Свяжитесь с администратором для уточнения"
+    "</blockquote>"
+)
+
+# Текст заявки из сообщения админа приходит без разметки — экранируется заново
+WITHDRAWAL_PROCESSED = Template(
+    "{request_text}\n\n"
+    "<b>{status_line}</b>\n"
+    "👤 Админ: @{admin}"
+)
+WITHDRAWAL_PROCESSED_STATUS = {"paid": "✅ Статус обновлен: Выплачено", "rejected": "❌ Статус обновлен: Отклонено"}
+
+# === РОЗЫГРЫШИ ===
+GIVEAWAY_CARD = Template(
+    "🎰 <b>АКТИВНЫЙ РОЗЫГРЫШ NFT!</b>\n\n"
+    "<blockquote>"
+    "💎 <b>Приз:</b> <a href='{nft_link}'>NFT Подарок</a>\n"
+    "💰 <b>Ставка:</b> {bet_amount} ⭐ Stars\n"
+    "👥 <b>Уникальных игроков:</b> {unique_users}\n"
+    "🎲 <b>Всего бросков:</b> {total_attempts}\n"
+    "🎯 <b>Условия:</b> Выпадет <b>777 (64)</b> = выигрыш!"
+    "</blockquote>\n\n"
+    "<blockquote>🍀 <b>Испытайте свою удачу!</b>\n"
+    "Нажмите кнопку ниже, оплатите {bet_amount} Stars и сыграйте.\n"
+    "Если выпадет <b>777 (64)</b> (максимум) — NFT ваш!\n\n"
+    "<i>Попыток неограничено!</i></blockquote>"
+)
+
+PAYMENT_OK = Template(
+    "✅ <b>Оплата прошла успешно!</b>\n\n"
+    "<blockquote>"
+    "🎰 Попытка #{attempt}\n"
+    "💎 Приз: <a href='{nft_link}'>NFT Подарок</a>\n"
+    "🎯 Цель: Выпадение 777 (64)"
+    "</blockquote>\n\n"
+    "<b>👉 Отправьте анимированный эмодзи</b> 🎰 <b>(Слот-машина)</b>\n\n"
+)
+
+WRONG_DICE = Template(
+    "❌ <b>Нужен именно эмодзи Слот-машины</b> 🎰!\n\n"
+    "Вы отправили: {emoji}\n"
+)
+
+WIN = Template(
+    "🎉 <b>ПОЗДРАВЛЯЕМ!</b>\n\n"
+    "<blockquote>🎰 Выпало: <b>777 {dice_value}</b>\n"
+    "Вы выиграли NFT!</blockquote>\n\n"
+    "Администратор свяжется с вами для передачи приза."
+)
+
+LOSE = Template(
+    "😔 <b>Не повезло...</b>\n\n"
+    "<blockquote>🎰 Выпало: <b>{dice_value}</b> из 64\n\n"
+    "Нужно было <b>777 (64)</b> для победы!\n\n"
+    "Хотите попробовать снова? Нажмите '🎰 Получить NFT' в меню!</blockquote>"
+)
+
+TOO_LATE = Template(
+    "😔 <b>Чуть-чуть не успели!</b>\n\n"
+    "<blockquote>🎰 Выпало: <b>777 {dice_value}</b>, но приз уже забрал другой участник.\n\n"
+    "Следите за новыми розыгрышами в меню '🎰 Получить NFT'!</blockquote>"
+)
+
+WINNER_ADMIN = Template(
+    "🏆 <b>ПОБЕДИТЕЛЬ В РОЗЫГРЫШЕ NFT!</b>\n\n"
+    "<blockquote>"
+    "👤 Победитель: <a href='tg://user?id={user_id}'>{user_name}</a>\n"
+    "🆔 ID: <code>{user_id}</code>\n"
+    "🔗 NFT: <a href='{nft_link}'>Ссылка на приз</a>\n"
+    "🆔 ID розыгрыша: #{giveaway_id}"
+    "</blockquote>\n\n"
+    "<b>Отправьте NFT победителю!</b>"
+)
+
+WINNER_ANNOUNCE = Template(
+    "🎉 <b>ПОБЕДИТЕЛЬ ОПРЕДЕЛЕН!</b>\n\n"
+    "<blockquote>"
+    "🏆 <b>{user_name}</b> выиграл NFT!\n"
+    "💎 Приз: <a href='{nft_link}'>NFT Подарок</a>"
+    "</blockquote>\n\n"
+    "🍀 <b>Испытайте свою удачу тоже!</b>\n"
+    "Нажмите '🎰 Получить NFT' в меню!"
+)
+
+GIVEAWAY_CREATED = Template(
+    "✅ <b>Розыгрыш #{giveaway_id} создан!</b>\n\n"
+    "<blockquote>"
+    "💰 Ставка: {bet_amount} Stars\n"
+    "💎 NFT: {nft_link}\n"
+    "🎰 Условие: Выпадение 777 (64)"
+    "</blockquote>\n\n"
+    "Начинаю рассылку уведомлений..."
+)
+
+GIVEAWAY_ANNOUNCE = Template(
+    "🎰 <b>НОВЫЙ РОЗЫГРЫШ NFT!</b>\n\n"
+    "<blockquote>"
+    "💎 Новый приз разыгрывается!\n"
+    "💰 Ставка: {bet_amount} Stars\n"
+    "🎯 Условие: Выпадение 777 (64)\n"
+    "🔗 <a href='{nft_link}'>Посмотреть приз</a>"
+    "</blockquote>\n\n"
+    "<b>🍀 Испытайте удачу!</b> Нажмите '🎰 Получить NFT' в меню!"
+)
+
+# === АДМИНКА ===
+ADMIN_WELCOME = Template(
+    "👑 <b>ПАНЕЛЬ АДМИНИСТРАТОРА</b>\n\n"
+    "Добро пожаловать, <b>{full_name}</b>!\n\n"
+    "<blockquote>Выберите раздел:</blockquote>"
+)
+
+ADMIN_STATS = Template(
+    "📊 <b>ПОДРОБНАЯ СТАТИСТИКА БОТА</b>\n\n"
+    "<b>👥 Пользователи:</b>\n"
+    "<blockquote>"
+    "├ Всего: <b>{total_users}</b>\n"
+    "├ Новых сегодня: <b>{new_today}</b>\n"
+    "├ Недоступны (блок/удалены): <b>{unreachable_users}</b>\n"
+    "└ Рефералов всего: <b>{total_referrals}</b>"
+    "</blockquote>\n\n"
+    "<b>💸 Выводы Stars:</b>\n"
+    "<blockquote>"
+    "├ Всего заявок: <b>{total_withdrawals}</b>\n"
+    "├ В обработке: <b>{pending_count}</b>\n"
+    "├ Выплачено: <b>{paid_count}</b>\n"
+    "├ Всего выплачено: <b>{total_paid}</b> ⭐\n"
+    "└ В ожидании: <b>{pending_amount}</b> ⭐"
+    "</blockquote>\n\n"
+    "<b>🎰 NFT Розыгрыши:</b>\n"
+    "<blockquote>"
+    "├ Активных: <b>{active_giveaways}</b>\n"
+    "├ Проведено: <b>{completed_giveaways}</b>\n"
+    "├ Всего создано: <b>{total_giveaways}</b>\n"
+    "└ Попыток в текущем: <b>{current_attempts}</b>"
+    "</blockquote>\n\n"
+    "<b>💳 Платежи Stars:</b>\n"
+    "<blockquote>"
+    "├ Всего платежей: <b>{total_payments}</b>\n"
+    "├ Выручка сегодня: <b>{revenue_today}</b> ⭐\n"
+    "└ Выручка всего: <b>{revenue_total}</b> ⭐"
+    "</blockquote>\n\n"
+    "<b>🗄 Кэш пользователей:</b>\n"
+    "<blockquote>"
+    "├ Записей: <b>{cache_size}</b> / {cache_maxsize}\n"
+    "├ Попадания: <b>{cache_hits}</b> ({cache_hit_rate:.0%})\n"
+    "├ Промахи: <b>{cache_misses}</b>\n"
+    "└ Вытеснено: <b>{cache_evictions}</b>"
+    "</blockquote>\n\n"
+    "<b>🔒 Замки пользователей:</b>\n"
+    "<blockquote>"
+    "├ Сейчас занято: <b>{lock_active}</b>\n"
+    "├ Захватов: <b>{lock_acquired}</b> (с ожиданием {lock_contended})\n"
+    "├ Ожидание: ср. {lock_wait_avg:.2f} с, макс. {lock_wait_max:.2f} с\n"
+    "└ Таймаутов: <b>{lock_timeouts}</b>"
+    "</blockquote>\n\n"
+    "<b>⏱ Pre-checkout:</b>\n"
+    "<blockquote>"
+    "├ Ответов: <b>{checkout_count}</b> (медленных {checkout_slow})\n"
+    "└ Время: ср. {checkout_avg_ms:.0f} мс, p95 {checkout_p95_ms:.0f} мс, "
+    "макс. {checkout_max_ms:.0f} мс"
+    "</blockquote>\n\n"
+    "<b>🏆 Топ-5 рефереров:</b>\n<blockquote>"
+)
+
+ADMIN_TOP_ROW = Template("{idx}. {name} — {refs} ref / {stars} ⭐\n")
+
+ADMIN_GIVEAWAY_ACTIVE = Template(
+    "🎰 <b>УПРАВЛЕНИЕ РОЗЫГРЫШАМИ</b>\n\n"
+    "<b>🔥 Активен розыгрыш #{giveaway_id}</b>\n\n"
+    "<blockquote>"
+    "💰 Ставка: {bet_amount} Stars\n"
+    "💎 NFT: <a href='{nft_link}'>Ссылка на приз</a>\n"
+    "👥 Уникальных игроков: {unique_users}\n"
+    "🎲 Всего попыток: {total_attempts}\n"
+    "⭐ Собрано: {stars_collected} Stars\n"
+    "📅 Создан: {created}"
+    "</blockquote>\n\n"
+    "Выберите действие:"
+)
+
+ADMIN_GIVEAWAY_NONE = (
+    "🎰 <b>УПРАВЛЕНИЕ РОЗЫГРЫШАМИ</b>\n\n"
+    "<blockquote>Сейчас нет активных розыгрышей.</blockquote>"
+)
+
+ADMIN_ASK_NFT_LINK = Template(
+    "🎰 <b>СОЗДАНИЕ НОВОГО РОЗЫГРЫША</b>\n\n"
+    "<b>Шаг 1:</b> ✅ Ставка: {bet_amount} Stars\n"
+    "<b>Шаг 2/2:</b> Отправьте ссылку на NFT приз\n\n"
+    "<i>Пример: https://t.me/nft/mygift</i>"
+)
+
+ADMIN_GIVEAWAY_STOPPED = Template(
+    "✅ <b>Розыгрыш #{giveaway_id} завершен!</b>\n\n"
+    "<blockquote>Статистика сохранена в истории.</blockquote>"
+)
+
+HISTORY_HEADER = "📜 <b>ПОСЛЕДНИЕ ЗАВЕРШЕННЫЕ РОЗЫГРЫШИ</b>\n\n"
+HISTORY_ROW = Template(
+    "<blockquote><b>#{giveaway_id}</b>\n"
+    "💰 Ставка: {bet_amount} Stars\n"
+    "🏆 Победитель: {winner_name}\n"
+    "📅 {ended}</blockquote>\n\n"
+)
+
+BROADCASTS_HEADER = "📢 <b>ПОСЛЕДНИЕ РАССЫЛКИ</b>\n\n"
+BROADCAST_ROW = Template(
+    "<blockquote><b>#{job_id}</b> {status}\n"
+    "├ Прогресс: {done}/{total} ({percent}%)\n"
+    "├ Успешно: {sent} | Ошибок: {failed}\n"
+    "└ {tail}</blockquote>\n\n"
+)
+BROADCAST_STATUS_TEXT = {"running": "⏳ Идет", "done": "✅ Завершена", "cancelled": "⛔ Отменена"}
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from typing import Optional, Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Не больше limit апдейтов в обработке одновременно. Остальные ждут
+    своей очереди (а вместе с ними и HTTP-ответ Telegram — это и есть
+    обратное давление на вебхук). pre_checkout_query идут без очереди:
+    на ответ у бота 10 секунд, а проверка не ходит в БД.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update) and event.pre_checkout_query is not None:
+            return await handler(event, data)
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
+
+def build_app(dp: Dispatcher, bot: Bot, path: str, secret: Optional[str] = None) -> web.Application:
+    """aiohttp-приложение: POST path -> dispatcher, проверка X-Telegram-Bot-Api-Secret-Token"""
+    app = web.Application()
+    # Ответ отдается после обработки апдейта, чтобы лимит параллельности
+    # притормаживал и Telegram, а не копил фоновые задачи
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=secret,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    public_url: Optional[str] = None,
+    secret: Optional[str] = None,
+    max_concurrency: int = 50,
+):
+    """
+    Поднять вебхук-сервер и работать до отмены. Если задан public_url,
+    вебхук регистрируется в Telegram; без него сервер принимает апдейты
+    только локально (удобно для отладки: POST записанного JSON апдейта).
+    """
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(max_concurrency))
+    app = build_app(dp, bot, path, secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"🌐 Вебхук слушает http://{host}:{port}{path} (параллельно до {max_concurrency})")
+
+    try:
+        if public_url:
+            await bot.set_webhook(
+                url=public_url.rstrip("/") + path,
+                secret_token=secret,
+                max_connections=min(100, max(1, max_concurrency)),
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info(f"✅ Вебхук зарегистрирован: {public_url.rstrip('/')}{path}")
+        else:
+            logger.warning("WEBHOOK_URL не задан — вебхук в Telegram не регистрируется")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
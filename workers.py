@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Многопроцессный режим: супервизор получает апдейты (long polling или
+вебхук) как сырой JSON и раздает их N воркерам по user_id, так что все
+апдейты одного пользователя обрабатывает один процесс в исходном порядке.
+
+Запись в общую SQLite: у каждого процесса один писатель, транзакции
+открываются BEGIN IMMEDIATE (блокировка берется сразу, без апгрейда и
+взаимных блокировок), конкурент ждет до busy_timeout, а групповая запись
+держит блокировку одну короткую транзакцию на пачку. WAL не дает читателям
+мешать писателям. Изменения кэшей в памяти (пользователи, активный
+розыгрыш, счетчики) воркер публикует, супервизор пересылает остальным.
+
+Запуск: python workers.py (число воркеров — BOT_WORKERS).
+"""
+import asyncio
+import logging
+import multiprocessing
+import sys
+import threading
+from typing import Optional, Any, Dict, List, Set
+
+from config import (
+    BOT_TOKEN, TELEGRAM_API_URL, BOT_MODE, BOT_WORKERS, WORKER_CONCURRENCY, WORKER_QUEUE_SIZE,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET
+)
+
+logger = logging.getLogger(__name__)
+
+# Сообщения во входящую очередь воркера
+UPDATE = "update"
+SYNC = "sync"
+STOP = "stop"
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """user_id автора апдейта из сырого JSON (from / user / chat), без разбора моделей"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            value = event.get(field)
+            if isinstance(value, dict) and "id" in value:
+                return value["id"]
+    return None
+
+def shard_for(update: Dict[str, Any], workers: int) -> int:
+    """Номер воркера для апдейта; апдейты без пользователя — воркеру 0"""
+    user_id = update_user_id(update)
+    return user_id % workers if user_id is not None else 0
+
+# === ВОРКЕР ===
+def worker_main(index: int, inbox: Any, events: Any):
+    """Точка входа дочернего процесса"""
+    try:
+        asyncio.run(_worker(index, inbox, events))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker(index: int, inbox: Any, events: Any):
+    # bot импортируется только в воркере: супервизору диспетчер не нужен
+    import bot as app
+    import database
+
+    database.sync_listeners.append(lambda event, payload: events.put((index, event, payload)))
+    await app.on_startup(primary=index == 0)
+    logger.info(f"Воркер {index} готов")
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    # Последняя задача каждого пользователя: следующий апдейт ждет предыдущий
+    tails: Dict[int, asyncio.Task] = {}
+    # Проверки оплаты вне цепочек пользователей (ссылки держим, пока задача идет)
+    checkouts: Set[asyncio.Task] = set()
+
+    async def handle(user_id: Optional[int], update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            if "pre_checkout_query" in update:
+                # Без семафора: на ответ у бота 10 секунд
+                await app.dp.feed_raw_update(app.bot, update)
+            else:
+                async with semaphore:
+                    await app.dp.feed_raw_update(app.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            if user_id is not None and tails.get(user_id) is asyncio.current_task():
+                del tails[user_id]
+
+    try:
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            kind = message[0]
+            if kind == UPDATE:
+                update = message[1]
+                if "pre_checkout_query" in update:
+                    # Проверка оплаты не зависит от порядка — не ждет прошлых апдейтов пользователя
+                    task = asyncio.create_task(handle(None, update, None))
+                    checkouts.add(task)
+                    task.add_done_callback(checkouts.discard)
+                    continue
+                user_id = update_user_id(update)
+                task = asyncio.create_task(handle(user_id, update, tails.get(user_id)))
+                if user_id is not None:
+                    tails[user_id] = task
+            elif kind == SYNC:
+                await database.apply_sync_event(message[1], message[2])
+            elif kind == STOP:
+                break
+        pending = list(tails.values()) + list(checkouts)
+        if pending:
+            await asyncio.wait(pending)
+    finally:
+        await app.on_shutdown()
+        await app.bot.session.close()
+        logger.info(f"Воркер {index} остановлен")
+
+# === СУПЕРВИЗОР ===
+async def call_api(http: Any, api: Any, method: str, params: Dict[str, Any]) -> bool:
+    """Вызвать метод Bot API сырым запросом; ошибку ответа — в лог"""
+    try:
+        async with http.post(api.api_url(BOT_TOKEN, method), json=params) as response:
+            payload = await response.json()
+    except Exception as e:
+        logger.error(f"Ошибка {method}: {e}")
+        return False
+    if not payload.get("ok"):
+        logger.error(f"{method} вернул ошибку: {payload.get('description')}")
+        return False
+    return True
+
+class Supervisor:
+    """Запускает воркеров, раздает им апдейты и пересылает события синхронизации"""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        # spawn: дочерний процесс не наследует event loop и соединения родителя
+        self._ctx = multiprocessing.get_context("spawn")
+        self.inboxes = [self._ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(self.workers)]
+        self.events = self._ctx.Queue()
+        self.processes: List[Any] = []
+        self._relay: Optional[threading.Thread] = None
+
+    def start(self):
+        for index, inbox in enumerate(self.inboxes):
+            process = self._ctx.Process(
+                target=worker_main, args=(index, inbox, self.events), name=f"bot-worker-{index}"
+            )
+            process.start()
+            self.processes.append(process)
+        self._relay = threading.Thread(target=self._relay_events, daemon=True)
+        self._relay.start()
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    def _relay_events(self):
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            sender, event, payload = message
+            for index, inbox in enumerate(self.inboxes):
+                if index != sender:
+                    inbox.put((SYNC, event, payload))
+
+    async def dispatch(self, update: Dict[str, Any]):
+        """Отдать апдейт воркеру (ждет, если его очередь заполнена)"""
+        inbox = self.inboxes[shard_for(update, self.workers)]
+        await asyncio.get_running_loop().run_in_executor(None, inbox.put, (UPDATE, update))
+
+    def stop(self):
+        for inbox in self.inboxes:
+            inbox.put((STOP,))
+        for process in self.processes:
+            process.join()
+        self.events.put(None)
+        logger.info("Все воркеры остановлены")
+
+async def poll_updates(supervisor: Supervisor, api: Any, allowed_updates: List[str]):
+    """Long polling сырым getUpdates: апдейты не разбираются в модели aiogram"""
+    import aiohttp
+
+    offset = 0
+    async with aiohttp.ClientSession() as http:
+        await call_api(http, api, "deleteWebhook", {})
+        while True:
+            try:
+                async with http.post(
+                    api.api_url(BOT_TOKEN, "getUpdates"),
+                    json={"offset": offset, "timeout": 30, "allowed_updates": allowed_updates},
+                    timeout=aiohttp.ClientTimeout(total=40),
+                ) as response:
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not payload.get("ok"):
+                logger.error(f"getUpdates вернул ошибку: {payload.get('description')}")
+                await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+                continue
+            for update in payload["result"]:
+                offset = update["update_id"] + 1
+                await supervisor.dispatch(update)
+
+async def serve_webhook(supervisor: Supervisor, api: Any, allowed_updates: List[str]):
+    """Вебхук: проверка секрета и пересылка JSON воркеру; ответ сразу после постановки в очередь"""
+    from aiohttp import web, ClientSession
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(body="Unauthorized", status=401)
+        await supervisor.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"🌐 Вебхук супервизора слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        if WEBHOOK_URL:
+            params = {"url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, "allowed_updates": allowed_updates}
+            if WEBHOOK_SECRET:
+                params["secret_token"] = WEBHOOK_SECRET
+            async with ClientSession() as http:
+                if await call_api(http, api, "setWebhook", params):
+                    logger.info(f"✅ Вебхук зарегистрирован: {params['url']}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def supervise(workers: int = BOT_WORKERS):
+    from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+    api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+    # Типы апдейтов, на которые есть обработчики (без импорта bot в супервизоре это не узнать)
+    allowed_updates = ["message", "callback_query", "pre_checkout_query"]
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            await serve_webhook(supervisor, api, allowed_updates)
+        else:
+            await poll_updates(supervisor, api, allowed_updates)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    try:
+        asyncio.run(supervise())
+    except KeyboardInterrupt:
+        logger.info("❌ Бот остановлен вручную")
+        sys.exit(0)